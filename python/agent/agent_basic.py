@@ -1,83 +1,201 @@
-from llm import LLMInterface
+from llm import LLMInterface, ResponseTruncated
+from cancellation import CancellationToken, OperationCancelled
+from cascade import CascadeRouter
+from cassette import RecordingClient
+from conversation import Conversation
+from profiler import phase, profile_turn
+from output_sink import TerminalSink
+from token_counter import TokenBudgetExceeded
 
 # Configuration
-LLM_PROVIDER = "openai"  # Can be "openai" or "anthropic"
+LLM_PROVIDER = "openai"  # Can be "openai", "anthropic" or "ollama"
+CASSETTE_PATH = None  # Set to a file path to record provider traffic for replay
+# Cheaper providers tried before LLM_PROVIDER, e.g. ["ollama"]; must use the
+# same message format (ollama only goes in front of openai)
+CASCADE_PROVIDERS = []
+# Set to a directory to write a sampling profile of every turn; a message
+# starting with /profile profiles just that turn
+PROFILE_DIR = None
+# Read small files and list directories in the background while the first
+# message is typed, so the first tool calls are answered from memory
+WARM_UP = True
 
 SYS_PROMPT = """
-You are a helpful agent that can read files and list directory contents. 
-You have access to two tools:
+You are a helpful agent that can read and edit files and list directory contents. 
+You have access to eight tools:
 1. list_files - to list files in a directory
 2. read_file - to read the contents of a file
+3. search_files - to find lines containing a text in the files of a directory
+4. semantic_search - to find file passages related to a question
+5. read_blob - to read a line range of a large tool result stored as a blob
+6. diff_files - to show the differences between two files
+7. edit_file - to change a file with search/replace edits or a unified diff
+8. rewrite_file - to rewrite a whole file when most of it changes
 
 Use these tools when the user asks questions about files or directories.
 """
 
 
-def execute_tool(tool_call: dict, llm: LLMInterface) -> str:
-    """Execute a tool call and return the result"""
+def execute_tool(
+    tool_call: dict, llm: LLMInterface, cancel_token: CancellationToken = None
+) -> str:
+    """
+    Execute a tool call and return the result.
+    Chunks of streaming tools go to llm.output_sink while the tool runs.
+    """
     tool_name = tool_call["name"]
     tool_args = tool_call["args"]
 
     print(f"🔧 Calling tool: {tool_name} with args: {tool_args}")
 
-    if tool_name == "list_files":
-        path = tool_args.get("path", ".")
-        return llm.list_files_filtered(path)
-    elif tool_name == "read_file":
-        filepath = tool_args.get("filepath", "")
-        return llm.read_file_filtered(filepath)
-    else:
-        return f"Error: Unknown tool '{tool_name}'"
+    sink = llm.output_sink
+    streamed = False
+
+    def on_chunk(chunk: str) -> None:
+        nonlocal streamed
+        streamed = True
+        sink.write(chunk)
+
+    with phase("tool"):
+        result = llm.tool_registry.execute(
+            tool_name, tool_args, cancel_token, on_chunk if sink else None
+        )
+    if streamed:
+        sink.write("\n")
+        sink.flush()
+    return result
+
+
+def run_turn(
+    llm: LLMInterface,
+    messages: list,
+    cancel_token: CancellationToken = None,
+    system_prompt: str = SYS_PROMPT,
+    token_budget: int = None,
+    task_type: str = "answer",
+) -> str:
+    """
+    Run completions and tool calls until the LLM gives a final answer.
+    task_type selects the output budget of each request (see TASK_OUTPUT_BUDGETS).
+    Raises TokenBudgetExceeded once the session has used token_budget tokens.
+    Writes a profile of the turn if llm.profile_dir is set.
+    """
+    # Cheaper cascade tiers answer without reaching the interface that warms up
+    llm.stop_warm_up()
+    with profile_turn(llm.profile_dir):
+        return _run_turn(
+            llm, messages, cancel_token, system_prompt, token_budget, task_type
+        )
+
+
+def _run_turn(
+    llm, messages, cancel_token, system_prompt, token_budget, task_type
+) -> str:
+    while True:
+        usage = llm.usage
+        if token_budget and usage.input_tokens + usage.output_tokens >= token_budget:
+            raise TokenBudgetExceeded(f"Used up the budget of {token_budget} tokens")
+
+        # Get completion from LLM
+        response_text, tool_calls = llm.create_completion(
+            messages, system_prompt, task_type, cancel_token
+        )
+
+        if not tool_calls:
+            messages.append({"role": "assistant", "content": response_text})
+            return response_text
+
+        # Add assistant message with tool calls for OpenAI compatibility
+        with phase("history"):
+            llm.add_assistant_message_with_tools(messages, tool_calls)
+
+        # Execute each tool call
+        for tool_call in tool_calls:
+            result = execute_tool(tool_call, llm, cancel_token)
+            with phase("history"):
+                llm.add_tool_response(messages, tool_call, result)
 
 
 def run_agent():
     """Main agent loop"""
     print(f"🤖 File Agent (using {LLM_PROVIDER.upper()}) - Ready to help!")
     print("Type 'quit' to exit")
+    print("Start a message with /fanout to split it across parallel sub-agents")
+    print("Start a message with /profile to write a sampling profile of that turn")
     print("-" * 50)
 
     # Initialize LLM interface
-    llm = LLMInterface(LLM_PROVIDER)
+    llm = LLMInterface(LLM_PROVIDER, warm_up=WARM_UP)
+    if CASSETTE_PATH:
+        llm.client = RecordingClient(llm.client, LLM_PROVIDER, CASSETTE_PATH)
+    if CASCADE_PROVIDERS:
+        tiers = [LLMInterface(provider) for provider in CASCADE_PROVIDERS]
+        llm = CascadeRouter(tiers + [llm])
+    # Stream the responses to the terminal in batches
+    llm.output_sink = TerminalSink()
+    llm.profile_dir = PROFILE_DIR
 
     # Initialize conversation
-    messages = []
-    waiting_for_user_input = True
+    messages = Conversation()
 
     while True:
-        if waiting_for_user_input:
-            user_input = input("\n💬 You: ").strip()
-
-            if user_input.lower() in ["quit", "exit", "q"]:
-                print("👋 Goodbye!")
-                break
+        user_input = input("\n💬 You: ").strip()
+
+        if user_input.lower() in ["quit", "exit", "q"]:
+            usage = llm.usage
+            print(
+                f"📊 {usage.requests} requests, {usage.input_tokens} input "
+                f"({usage.cached_tokens} cached) / {usage.output_tokens} output "
+                f"tokens, ${usage.cost:.4f}"
+            )
+            if CASCADE_PROVIDERS:
+                print(llm.report())
+            print("👋 Goodbye!")
+            break
+
+        if not user_input:
+            continue
 
-            if not user_input:
-                continue
+        profile_once = user_input.startswith("/profile ")
+        if profile_once:
+            user_input = user_input.removeprefix("/profile ")
+            llm.profile_dir = PROFILE_DIR or "agent-profiles"
 
-            messages.append({"role": "user", "content": user_input})
-            waiting_for_user_input = False
+        # Everything from here on is rolled back if the turn is interrupted
+        turn_start = len(messages)
+        cancel_token = CancellationToken()
+        messages.append({"role": "user", "content": user_input})
 
         print("\n🤖 Agent: ", end="", flush=True)
 
-        # Get completion from LLM
-        response_text, tool_calls = llm.create_completion(messages, SYS_PROMPT)
-
-        if tool_calls:
-            # Add assistant message with tool calls for OpenAI compatibility
-            llm.add_assistant_message_with_tools(messages, tool_calls)
-
-            # Execute each tool call
-            for tool_call in tool_calls:
-                result = execute_tool(tool_call, llm)
-                llm.add_tool_response(messages, tool_call, result)
-
-            # Continue the loop to get LLM response after tool calls
+        try:
+            if user_input.startswith("/fanout "):
+                from fanout import run_fanout
+
+                task = user_input.removeprefix("/fanout ")
+                answer = run_fanout(llm, task, cancel_token)
+                messages.append({"role": "assistant", "content": answer})
+            else:
+                run_turn(llm, messages, cancel_token)
+        except (KeyboardInterrupt, OperationCancelled):
+            # Stop any in-flight work and drop the whole turn, so the history
+            # never ends with a tool call that has no result
+            cancel_token.cancel()
+            del messages[turn_start:]
+            print("\n⏹️  Interrupted, the last request was discarded")
             continue
-        else:
-            # No tool calls, print the final response
-            print(response_text)
-            messages.append({"role": "assistant", "content": response_text})
-            waiting_for_user_input = True
+        except ResponseTruncated as e:
+            del messages[turn_start:]
+            print(f"\n⚠️  {e}, the last request was discarded")
+            continue
+        finally:
+            # Whatever is still buffered goes out at the end of the turn
+            llm.output_sink.flush()
+            if profile_once:
+                llm.profile_dir = PROFILE_DIR
+
+        # The response was already streamed through the output sink
+        print()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# scorer(text, tool_calls) -> score, or None if the candidate is invalid
+Scorer = Callable[[Optional[str], Optional[List[Dict]]], Optional[float]]
+
+
+@dataclass
+class Candidate:
+    index: int
+    text: Optional[str]
+    tool_calls: Optional[List[Dict]]
+    score: Optional[float]
+    # Seconds from the request to the end of this candidate
+    latency: float
+
+
+@dataclass
+class BestOfN:
+    """The selected candidate and what the selection cost"""
+
+    text: Optional[str]
+    tool_calls: Optional[List[Dict]]
+    score: Optional[float]
+    # Candidates that finished before the selection, in finishing order
+    candidates: List[Candidate]
+    requested: int
+    # Seconds until the candidate was selected
+    latency: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+
+    @property
+    def stopped_early(self) -> int:
+        """Candidates that were cancelled once a winner was found"""
+        return self.requested - len(self.candidates)
+
+    def report(self) -> str:
+        return (
+            f"best of {self.requested}: {len(self.candidates)} finished, "
+            f"{self.stopped_early} stopped early, {self.latency:.2f}s, "
+            f"{self.input_tokens} input / {self.output_tokens} output tokens, "
+            f"${self.cost:.4f}"
+        )
+
+
+class CandidateJudge:
+    """
+    Scores candidates as they finish, from any thread. A candidate passes
+    when it is valid and reaches accept_score (any valid one if that's None)
+    """
+
+    def __init__(self, scorer: Optional[Scorer], accept_score: Optional[float]):
+        self.scorer = scorer
+        self.accept_score = accept_score
+        self.candidates: List[Candidate] = []
+        self.winner: Optional[Candidate] = None
+        self.started = time.monotonic()
+        self.selected_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        index: int,
+        text: Optional[str],
+        tool_calls: Optional[List[Dict]],
+        truncated: bool = False,
+    ) -> bool:
+        """
+        Record a finished candidate; True once the remaining ones can stop.
+        Truncated candidates (cut off by max_tokens) are recorded as invalid.
+        """
+        score = 0.0
+        if truncated:
+            score = None
+        elif self.scorer:
+            try:
+                score = self.scorer(text, tool_calls)
+            except Exception:
+                score = None
+        now = time.monotonic()
+        candidate = Candidate(index, text, tool_calls, score, now - self.started)
+        with self._lock:
+            self.candidates.append(candidate)
+            if self.winner is not None:
+                return True
+            if score is not None and (
+                self.accept_score is None or score >= self.accept_score
+            ):
+                self.winner = candidate
+                self.selected_at = now
+                return True
+            return False
+
+    def best(self) -> Optional[Candidate]:
+        """The passing candidate, otherwise the best scored one"""
+        if self.winner is not None:
+            return self.winner
+        valid = [c for c in self.candidates if c.score is not None]
+        if not valid:
+            return None
+        self.selected_at = time.monotonic()
+        return max(valid, key=lambda c: c.score)
@@ -0,0 +1,101 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+# Tool results longer than this (in characters) are offloaded to the blob store
+OFFLOAD_THRESHOLD = 8000
+
+# Number of lines shown as a preview of an offloaded result
+PREVIEW_LINES = 20
+
+# Maximum number of lines returned by a single blob read
+MAX_READ_LINES = 400
+
+
+class BlobStore:
+    """
+    Content-addressed store for large tool results kept out of the message
+    history. Without a root, blobs go to a private temporary directory that
+    is created on first use and removed at exit.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self._root = Path(root) if root else None
+
+    @property
+    def root(self) -> Path:
+        if self._root is None:
+            self._root = Path(tempfile.mkdtemp(prefix="llm-agent-blobs-"))
+            atexit.register(shutil.rmtree, self._root, ignore_errors=True)
+        return self._root
+
+    def _path(self, handle: str) -> Path:
+        return self.root / handle
+
+    def put(self, content: str) -> str:
+        """Store content and return its handle (sha256 of the content)"""
+        data = content.encode("utf-8")
+        handle = hashlib.sha256(data).hexdigest()[:16]
+        path = self._path(handle)
+        if not path.exists():
+            self.root.mkdir(parents=True, exist_ok=True)
+            # Write to a temp file first so readers never see a partial blob
+            fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_name, path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+        return handle
+
+    def exists(self, handle: str) -> bool:
+        if self._root is None:
+            return False
+        return handle.isalnum() and self._path(handle).exists()
+
+    def read_lines(self, handle: str, start_line: int = 1, end_line: int = 0) -> str:
+        """Return lines start_line..end_line (1-based, inclusive) of a blob"""
+        if not self.exists(handle):
+            return f"Error: Unknown blob handle '{handle}'"
+
+        start_line = max(start_line, 1)
+        last_allowed = start_line + MAX_READ_LINES - 1
+        end_line = min(end_line, last_allowed) if end_line else last_allowed
+        lines = []
+        with self._path(handle).open(encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if line_number < start_line:
+                    continue
+                if line_number > end_line:
+                    break
+                lines.append(line)
+
+        if not lines:
+            return f"Error: Blob '{handle}' has no lines from {start_line}"
+
+        last_line = start_line + len(lines) - 1
+        return f"Lines {start_line}-{last_line} of blob '{handle}':\n" + "".join(lines)
+
+    def offload(self, content: str) -> str:
+        """
+        Store content and return a short summary referencing it, or the
+        content itself if it can't be stored
+        """
+        try:
+            handle = self.put(content)
+        except OSError:
+            return content
+        lines = content.splitlines()
+        preview = "\n".join(lines[:PREVIEW_LINES])
+        return (
+            f"[Large tool result stored as blob '{handle}': "
+            f"{len(lines)} lines, {len(content)} characters. "
+            f"Use the read_blob tool to fetch line ranges.]\n"
+            f"First {min(PREVIEW_LINES, len(lines))} lines:\n{preview}"
+        )
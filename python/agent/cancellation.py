@@ -0,0 +1,57 @@
+import threading
+from typing import Callable, List
+
+
+class OperationCancelled(Exception):
+    """Raised when a completion or tool call is cancelled; carries any partial output"""
+
+    def __init__(self, partial_text: str = ""):
+        super().__init__("Operation cancelled")
+        self.partial_text = partial_text
+
+
+class CancellationToken:
+    """Thread-safe flag that in-flight completions and tool calls watch"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel and run the registered callbacks (e.g. closing open streams)"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Register a callback; runs right away if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self, partial_text: str = "") -> None:
+        if self._event.is_set():
+            raise OperationCancelled(partial_text)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds, returning early (True) when cancelled"""
+        return self._event.wait(timeout)
@@ -0,0 +1,182 @@
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cancellation import CancellationToken, OperationCancelled
+from llm import LLMInterface
+from token_counter import UsageTotals
+
+# Answers shorter than this (in characters) count as low confidence
+MIN_ANSWER_CHARS = 20
+
+# Phrases that suggest the model is unsure of its answer
+LOW_CONFIDENCE_PATTERN = re.compile(
+    r"\b(i'?m not sure|i am not sure|i don'?t know|i cannot|i can'?t help|unclear)\b",
+    re.IGNORECASE,
+)
+
+JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "object": dict,
+    "array": list,
+}
+
+
+@dataclass
+class TierStats:
+    calls: int = 0
+    accepted: int = 0
+    total_latency: float = 0.0
+    escalations: Counter = field(default_factory=Counter)
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+
+class CascadeRouter:
+    """
+    Sends each turn to the cheapest tier first and escalates to the next
+    (larger) tier on failed tool-arg validation, a low-confidence answer, an
+    error or an explicit rule. Offers the same interface as LLMInterface, so
+    it can be used in place of one; tools run on the last tier.
+    """
+
+    def __init__(
+        self,
+        tiers: List[LLMInterface],
+        rules: Optional[List[Callable[[List[Dict]], bool]]] = None,
+    ):
+        if len({tier.message_format for tier in tiers}) != 1:
+            raise ValueError("All cascade tiers must use the same message format")
+        self.tiers = tiers
+        # rule(messages) -> True sends the turn straight to the last tier
+        self.rules = rules or []
+        # By tier index, tiers may share a model
+        self.stats = [TierStats() for _ in tiers]
+        self._output_sink = None
+
+    def __getattr__(self, name):
+        # Tools, history helpers and token counts come from the last tier
+        return getattr(self.tiers[-1], name)
+
+    @property
+    def usage(self) -> UsageTotals:
+        """Usage and cost totals of all tiers"""
+        total = UsageTotals()
+        for tier in self.tiers:
+            total.add(tier.token_counter.usage)
+        return total
+
+    @property
+    def output_sink(self):
+        return self._output_sink
+
+    @output_sink.setter
+    def output_sink(self, sink):
+        # Only the last tier streams directly; answers of cheaper tiers are
+        # written out once accepted, so rejected ones never reach the user
+        self._output_sink = sink
+        self.tiers[-1].output_sink = sink
+
+    def _validate_tool_call(self, tier: LLMInterface, tool_call: Dict) -> bool:
+        """Check the tool exists and its args match the declared schema"""
+        schemas = {}
+        for tool in tier.tools:
+            if "function" in tool:
+                schemas[tool["function"]["name"]] = tool["function"]["parameters"]
+            else:
+                schemas[tool["name"]] = tool["input_schema"]
+
+        schema = schemas.get(tool_call["name"])
+        args = tool_call["args"]
+        if schema is None or not isinstance(args, dict):
+            return False
+        if any(name not in args for name in schema.get("required", [])):
+            return False
+        for name, value in args.items():
+            prop = schema.get("properties", {}).get(name)
+            if prop is None:
+                return False
+            expected = JSON_TYPES.get(prop.get("type"))
+            if expected and not isinstance(value, expected):
+                return False
+        return True
+
+    def _escalation_reason(
+        self, tier: LLMInterface, text: Optional[str], tool_calls: Optional[List[Dict]]
+    ) -> Optional[str]:
+        if tool_calls:
+            for tool_call in tool_calls:
+                if not self._validate_tool_call(tier, tool_call):
+                    return "invalid_tool_args"
+            return None
+        if not text or len(text.strip()) < MIN_ANSWER_CHARS:
+            return "short_answer"
+        if LOW_CONFIDENCE_PATTERN.search(text):
+            return "low_confidence"
+        return None
+
+    def create_completion(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Tuple[Optional[str], Optional[List[Dict]]]:
+        """Create a completion on the cheapest tier that gives a confident result"""
+        forced = any(rule(messages) for rule in self.rules)
+        for i, tier in enumerate(self.tiers):
+            stats = self.stats[i]
+            is_last = i == len(self.tiers) - 1
+            if forced and not is_last:
+                stats.escalations["rule"] += 1
+                continue
+
+            started = time.monotonic()
+            try:
+                text, tool_calls = tier.create_completion(
+                    messages, system_prompt, task_type, cancel_token
+                )
+            except OperationCancelled:
+                raise
+            except Exception:
+                if is_last:
+                    raise
+                stats.calls += 1
+                stats.escalations["error"] += 1
+                continue
+            finally:
+                stats.total_latency += time.monotonic() - started
+
+            stats.calls += 1
+            reason = (
+                None if is_last else self._escalation_reason(tier, text, tool_calls)
+            )
+            if reason:
+                stats.escalations[reason] += 1
+                continue
+
+            stats.accepted += 1
+            if not is_last and text and self._output_sink:
+                self._output_sink.write(text)
+                self._output_sink.flush()
+            return text, tool_calls
+
+    def report(self) -> str:
+        """Per-tier latency, acceptance, escalation and cost stats"""
+        lines = []
+        for i, (tier, stats) in enumerate(zip(self.tiers, self.stats), start=1):
+            usage = tier.token_counter.usage
+            escalations = ", ".join(f"{k}={v}" for k, v in stats.escalations.items())
+            lines.append(
+                f"{i}. {tier.model}: {stats.calls} calls, {stats.accepted} accepted, "
+                f"avg {stats.average_latency:.2f}s, ${usage.cost:.4f}"
+                + (f", escalated: {escalations}" if escalations else "")
+            )
+        return "\n".join(lines)
@@ -0,0 +1,241 @@
+"""
+Record provider traffic of LLMInterface into cassette files and replay it offline.
+
+Record a session (wraps the real client):
+    llm = LLMInterface("openai")
+    llm.client = RecordingClient(llm.client, "openai", "session.cassette")
+
+Replay through the real LLMInterface code paths:
+    python agent/cassette.py session.cassette --provider openai --timing fast
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+# Request fields that change between otherwise identical requests
+VOLATILE_KEYS = {"id", "tool_call_id", "tool_use_id", "max_tokens", "stream_options"}
+
+# Parameters of a plain create_completion request; requests with others
+# (structured output, predicted outputs, n samples) are replayed as recorded
+COMPLETION_KEYS = {"model", "messages", "tools", "system", "stream"}
+
+# Any value works for replaying, max_tokens is not part of the match key
+REPLAY_MAX_TOKENS = 1024
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if hasattr(value, "model_dump"):
+        return _normalize(value.model_dump(mode="json"))
+    return value
+
+
+def request_key(request: Dict) -> str:
+    """Match key of a request, ignoring volatile fields like tool call ids"""
+    normalized = json.dumps(_normalize(request), sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class _RecordingStream:
+    """Passes chunks through while timing them; saves the exchange when done"""
+
+    def __init__(self, stream, on_done, started: float):
+        self._stream = stream
+        self._on_done = on_done
+        self._started = started
+        self._chunks: List = []
+        self._saved = False
+
+    def __iter__(self):
+        for chunk in self._stream:
+            offset = time.perf_counter() - self._started
+            self._chunks.append([round(offset, 4), chunk.model_dump(mode="json")])
+            yield chunk
+        self._save()
+
+    def _save(self):
+        if not self._saved:
+            self._saved = True
+            self._on_done(self._chunks)
+
+    def close(self):
+        self._stream.close()
+        self._save()
+
+
+class RecordingClient:
+    """Wraps an OpenAI or Anthropic client and appends every exchange to a cassette"""
+
+    def __init__(self, client: Any, provider: str, path: str):
+        self._client = client
+        self.provider = provider
+        self.path = path
+        # Sub-agents share the client, appends must not interleave
+        self._lock = threading.Lock()
+        if provider != "anthropic":
+            self.chat = SimpleNamespace(
+                completions=SimpleNamespace(create=self._create)
+            )
+        else:
+            self.messages = SimpleNamespace(create=self._create)
+
+    def _create(self, **request):
+        started = time.perf_counter()
+        if self.provider != "anthropic":
+            stream = self._client.chat.completions.create(**request)
+        else:
+            stream = self._client.messages.create(**request)
+
+        def save(chunks):
+            entry = {
+                "key": request_key(request),
+                "request": _normalize(request),
+                "chunks": chunks,
+            }
+            # Appending gzip members keeps the file a valid gzip stream
+            with self._lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+        return _RecordingStream(stream, save, started)
+
+
+class _ReplayStream:
+    def __init__(self, chunks: List, parse, timing: str):
+        self._chunks = chunks
+        self._parse = parse
+        self._timing = timing
+        self.closed = False
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for offset, data in self._chunks:
+            if self.closed:
+                return
+            if self._timing == "original":
+                delay = offset - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            # Parse into the real SDK types so deserialization cost is included
+            yield self._parse(data)
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayClient:
+    """
+    Serves recorded exchanges in place of a provider client.
+    timing="original" reproduces the recorded chunk timings, "fast" plays
+    them back as fast as possible to measure client-side overhead alone.
+    """
+
+    def __init__(self, provider: str, path: str, timing: str = "original"):
+        self.provider = provider
+        self.timing = timing
+        self.entries: List[Dict] = []
+        self._by_key: Dict[str, deque] = defaultdict(deque)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.append(entry)
+                self._by_key[entry["key"]].append(entry)
+
+        if provider != "anthropic":
+            from openai.types.chat import ChatCompletionChunk
+
+            self._parse = ChatCompletionChunk.model_validate
+            self.chat = SimpleNamespace(
+                completions=SimpleNamespace(create=self._create)
+            )
+        else:
+            from anthropic.types import RawMessageStreamEvent
+            from pydantic import TypeAdapter
+
+            self._parse = TypeAdapter(RawMessageStreamEvent).validate_python
+            self.messages = SimpleNamespace(create=self._create)
+
+    def remaining(self, key: str) -> int:
+        return len(self._by_key[key])
+
+    def _create(self, **request):
+        key = request_key(request)
+        if not self._by_key[key]:
+            raise KeyError(f"No recorded exchange left for request {key[:12]}")
+        entry = self._by_key[key].popleft()
+        return _ReplayStream(entry["chunks"], self._parse, self.timing)
+
+
+def _replay_request(llm, request: Dict) -> None:
+    """Send a recorded request unchanged through the interface's streaming code"""
+    # Parameters missing from the recording (e.g. tools) must stay missing
+    options = {key: request.get(key) for key in COMPLETION_KEYS - {"messages"}}
+    options.update(request)
+    messages = options.pop("messages")
+    if llm.message_format == "openai":
+        llm._stream_openai_response(messages, REPLAY_MAX_TOKENS, None, options)
+    else:
+        system_prompt = options.pop("system")
+        llm._stream_anthropic_response(
+            messages, system_prompt, REPLAY_MAX_TOKENS, None, options
+        )
+
+
+def replay_session(path: str, provider: str, timing: str) -> None:
+    """
+    Send every recorded request through LLMInterface: plain completions
+    through create_completion, the requests of other calls (rewrite_file,
+    structured output, best-of-n) as recorded through the streaming code
+    """
+    from llm import LLMInterface
+
+    client = ReplayClient(provider, path, timing)
+    llm = LLMInterface(provider, client=client)
+
+    recorded = sum(e["chunks"][-1][0] for e in client.entries if e["chunks"])
+    started = time.perf_counter()
+    replayed = 0
+    for entry in client.entries:
+        # Requests made internally by an earlier replay (e.g. continuations)
+        # have already been consumed
+        if not client.remaining(entry["key"]):
+            continue
+
+        request = entry["request"]
+        if not set(request) <= COMPLETION_KEYS or "tools" not in request:
+            _replay_request(llm, request)
+            replayed += 1
+            continue
+
+        messages = request["messages"]
+        system_prompt = request.get("system", "")
+        if provider != "anthropic" and messages and messages[0]["role"] == "system":
+            system_prompt = messages[0]["content"]
+        llm.create_completion(messages, system_prompt)
+        replayed += 1
+
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {replayed} completions ({timing} timing) in {elapsed:.3f}s")
+    print(f"Recorded streaming time: {recorded:.3f}s")
+    if timing == "fast" and replayed:
+        print(f"Client-side overhead: {elapsed / replayed * 1000:.2f}ms per completion")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded cassette")
+    parser.add_argument("path")
+    parser.add_argument(
+        "--provider", default="openai", choices=["openai", "anthropic", "ollama"]
+    )
+    parser.add_argument("--timing", default="original", choices=["original", "fast"])
+    args = parser.parse_args()
+    replay_session(args.path, args.provider, args.timing)
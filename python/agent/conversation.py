@@ -0,0 +1,91 @@
+import json
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class _Node:
+    """One message and a link to the message before it; never changed once built"""
+
+    __slots__ = ("message", "parent", "length", "_encoded")
+
+    def __init__(self, message: Dict, parent: Optional["_Node"]):
+        self.message = message
+        self.parent = parent
+        self.length = parent.length + 1 if parent else 1
+        self._encoded = None
+
+    @property
+    def encoded(self) -> str:
+        if self._encoded is None:
+            self._encoded = json.dumps(self.message, sort_keys=True, default=str)
+        return self._encoded
+
+
+class Conversation:
+    """
+    Persistent message history that can be passed wherever a list of
+    messages is expected. Messages are stored as a linked list from the
+    newest to the oldest, so fork() is O(1) and branches share every
+    message from before the fork; each branch only stores its own
+    messages. Encodings are cached per message and reused by all branches.
+    Messages must not be modified after they were appended.
+    """
+
+    def __init__(self, messages: Iterable[Dict] = ()):
+        self._tail: Optional[_Node] = None
+        self.extend(messages)
+
+    def append(self, message: Dict) -> None:
+        self._tail = _Node(message, self._tail)
+
+    def extend(self, messages: Iterable[Dict]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def fork(self) -> "Conversation":
+        """A new branch starting from the current state of this one"""
+        branch = Conversation()
+        branch._tail = self._tail
+        return branch
+
+    def _nodes(self) -> List[_Node]:
+        nodes = []
+        node = self._tail
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+    def __len__(self) -> int:
+        return self._tail.length if self._tail else 0
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (node.message for node in self._nodes())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [node.message for node in self._nodes()[index]]
+        return self._nodes()[index].message
+
+    def __delitem__(self, index) -> None:
+        """Only the end can be dropped (del conversation[n:]), other branches keep it"""
+        if not isinstance(index, slice) or index.stop is not None or index.step:
+            raise TypeError("Only a tail slice (del conversation[n:]) can be deleted")
+        start = index.start or 0
+        if start < 0:
+            start = max(len(self) + start, 0)
+        while self._tail is not None and self._tail.length > start:
+            self._tail = self._tail.parent
+
+    def __add__(self, other: List[Dict]) -> List[Dict]:
+        return list(self) + list(other)
+
+    def __repr__(self) -> str:
+        return f"Conversation({len(self)} messages)"
+
+    def encoded_messages(self) -> List[str]:
+        """JSON encoding of each message, cached in the (shared) nodes"""
+        return [node.encoded for node in self._nodes()]
+
+    def to_json(self) -> str:
+        return "[" + ", ".join(self.encoded_messages()) + "]"
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+from agent_basic import SYS_PROMPT, run_turn
+from cancellation import CancellationToken
+from llm import LLMInterface
+from token_counter import UsageTotals
+
+# Sub-agents running at the same time
+MAX_PARALLEL_SUBAGENTS = 4
+
+# Upper limit for the number of subtasks the coordinator may create
+MAX_SUBTASKS = 8
+
+# Wall-clock limit for a single subtask (seconds)
+SUBTASK_TIMEOUT = 120
+
+# Tokens (input + output) a single sub-agent may use
+SUBTASK_TOKEN_BUDGET = 100_000
+
+PLANNER_PROMPT = f"""
+You are the coordinator of a team of agents that can read files and list directory contents.
+Split the user's task into independent subtasks that can be worked on in parallel,
+for example one subtask per module or file. Use the tools if you need to look
+around first. When done, respond with only a JSON array of subtask descriptions
+(strings), at most {MAX_SUBTASKS} of them. Each description must be self-contained.
+If the task can't be split, respond with a JSON array containing only the task.
+"""
+
+SUBAGENT_PROMPT = (
+    SYS_PROMPT
+    + """
+You are working on one part of a larger task. Focus only on your subtask and
+answer concisely, your answer will be merged with the answers of other agents.
+"""
+)
+
+MERGE_PROMPT = """
+You are given a task and the results of subtasks that other agents worked on.
+Combine them into a single answer to the original task. Mention any subtasks
+that failed.
+"""
+
+
+@dataclass
+class SubtaskResult:
+    task: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    tokens: int = 0
+    usage: Optional[UsageTotals] = None
+
+
+def _parse_subtasks(text: str, task: str) -> List[str]:
+    """Read the JSON array of subtasks, falling back to the task itself"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        subtasks = json.loads(text)
+    except json.JSONDecodeError:
+        return [task]
+    if not isinstance(subtasks, list) or not subtasks:
+        return [task]
+    return [str(s) for s in subtasks[:MAX_SUBTASKS]]
+
+
+def run_subtask(
+    parent: LLMInterface, task: str, parent_token: CancellationToken
+) -> SubtaskResult:
+    """
+    Run one sub-agent conversation in isolation, on the parent's client and
+    settings; failures end up in the result
+    """
+    result = SubtaskResult(task=task)
+    started = time.monotonic()
+    cancel_token = CancellationToken()
+    parent_token.on_cancel(cancel_token.cancel)
+    # Cancelling closes the in-flight stream, so a hung request can't hold the slot
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        cancel_token.cancel()
+
+    timer = threading.Timer(SUBTASK_TIMEOUT, on_timeout)
+    timer.start()
+    llm = None
+    try:
+        llm = parent.spawn()
+        messages = [{"role": "user", "content": task}]
+        result.answer = run_turn(
+            llm, messages, cancel_token, SUBAGENT_PROMPT, SUBTASK_TOKEN_BUDGET
+        )
+    except Exception as e:
+        if timed_out.is_set():
+            result.error = f"Timed out after {SUBTASK_TIMEOUT}s"
+        else:
+            result.error = f"{type(e).__name__}: {e}"
+    finally:
+        timer.cancel()
+        parent_token.remove_callback(cancel_token.cancel)
+        result.elapsed = time.monotonic() - started
+        if llm is not None:
+            result.usage = llm.token_counter.usage
+            result.tokens = result.usage.input_tokens + result.usage.output_tokens
+    return result
+
+
+def run_fanout(
+    llm: LLMInterface, task: str, cancel_token: Optional[CancellationToken] = None
+) -> str:
+    """
+    Split a task into subtasks, run them on parallel sub-agents and merge the
+    answers; wall-clock time follows the slowest subtask, not their sum
+    """
+    cancel_token = cancel_token or CancellationToken()
+    planner_messages = [{"role": "user", "content": task}]
+    # The JSON plan isn't meant for the user, keep it off the output sink
+    output_sink, llm.output_sink = llm.output_sink, None
+    try:
+        # The plan is a short JSON array
+        plan = run_turn(
+            llm,
+            planner_messages,
+            cancel_token,
+            PLANNER_PROMPT,
+            task_type="tool_routing",
+        )
+    finally:
+        llm.output_sink = output_sink
+    subtasks = _parse_subtasks(plan, task)
+    print(f"\n🔀 Running {len(subtasks)} subtask(s) in parallel")
+
+    pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_SUBAGENTS)
+    try:
+        futures = [pool.submit(run_subtask, llm, t, cancel_token) for t in subtasks]
+        results = [f.result() for f in futures]
+    except BaseException:
+        # Interrupted: stop the sub-agents instead of waiting for them
+        cancel_token.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    for r in results:
+        if r.usage:
+            # Sub-agent spend counts towards the session totals
+            llm.token_counter.usage.add(r.usage)
+        status = "✅" if r.error is None else f"❌ {r.error}"
+        print(f"  {status} {r.elapsed:.1f}s {r.tokens} tokens - {r.task[:60]}")
+
+    report = f"Task: {task}\n"
+    for i, r in enumerate(results, start=1):
+        outcome = r.answer if r.error is None else f"FAILED: {r.error}"
+        report += f"\n## Subtask {i}: {r.task}\n{outcome}\n"
+
+    merge_messages = [{"role": "user", "content": report}]
+    # The merged answer covers all subtasks
+    return run_turn(
+        llm, merge_messages, cancel_token, MERGE_PROMPT, task_type="long_form"
+    )
@@ -0,0 +1,186 @@
+import difflib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from file_reader import SNIFF_BYTES, describe_binary, detect_encoding
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+
+def read_for_edit(path: Path) -> Tuple[str, str]:
+    """Read a text file as (text, encoding); line endings are kept as they are"""
+    data = path.read_bytes()
+    kind = describe_binary(data[:SNIFF_BYTES])
+    if kind:
+        raise ValueError(f"'{path}' is a binary file ({kind}), it can't be edited")
+    encoding = detect_encoding(data[:SNIFF_BYTES])
+    return data.decode(encoding), encoding
+
+
+def diff_files(args: Dict, ignore_patterns: List[str]) -> str:
+    """
+    Unified diff of two text files, the diff_files tool. It runs in the tool
+    registry's process pool, so it stays a module-level function.
+    """
+    old_path, new_path = args.get("old_path", ""), args.get("new_path", "")
+    texts = []
+    for filepath in (old_path, new_path):
+        path = Path(filepath)
+        if any(path.name.startswith(pattern) for pattern in ignore_patterns):
+            return f"Error: Access to '{filepath}' is restricted for security reasons"
+        if not path.is_file():
+            return f"Error: File '{filepath}' does not exist"
+        texts.append(read_for_edit(path)[0].splitlines())
+
+    diff = difflib.unified_diff(
+        texts[0],
+        texts[1],
+        fromfile=old_path,
+        tofile=new_path,
+        n=args.get("context_lines", 3),
+        lineterm="",
+    )
+    return "\n".join(diff) or f"'{old_path}' and '{new_path}' are identical"
+
+
+def apply_search_replace(text: str, edits: List[Dict]) -> str:
+    """Apply {"search", "replace"} edits in order; each search must match exactly once"""
+    for number, edit in enumerate(edits, start=1):
+        search, replace = edit.get("search", ""), edit.get("replace", "")
+        if not search:
+            raise ValueError(f"Edit {number} has an empty search text")
+        count = text.count(search)
+        if count == 0 and "\r\n" in text:
+            # The model usually writes \n, the file may use \r\n
+            search = search.replace("\n", "\r\n")
+            replace = replace.replace("\n", "\r\n")
+            count = text.count(search)
+        if count == 0:
+            raise ValueError(f"Edit {number}: search text not found in the file")
+        if count > 1:
+            raise ValueError(
+                f"Edit {number}: search text found {count} times, "
+                "include more surrounding lines to make it unique"
+            )
+        text = text.replace(search, replace, 1)
+    return text
+
+
+def _parse_hunks(patch: str) -> List[Tuple[int, List[str], List[str]]]:
+    """(old start line, old lines, new lines) of each hunk of a unified diff"""
+    hunks = []
+    for line in patch.splitlines():
+        header = _HUNK_HEADER.match(line)
+        if header:
+            hunks.append((int(header.group(1)), [], []))
+        elif not hunks or line.startswith("\\"):
+            # File headers before the first hunk, "\ No newline at end of file"
+            continue
+        elif line.startswith("-"):
+            hunks[-1][1].append(line[1:])
+        elif line.startswith("+"):
+            hunks[-1][2].append(line[1:])
+        else:
+            # Context line; models often drop the leading space of empty ones
+            context = line[1:] if line.startswith(" ") else line
+            hunks[-1][1].append(context)
+            hunks[-1][2].append(context)
+    if not hunks:
+        raise ValueError("No hunks (@@ -a,b +c,d @@) found in the patch")
+    return hunks
+
+
+def _find_block(lines: List[str], block: List[str], hint: int) -> Optional[int]:
+    """Position of block in lines closest to hint, ignoring trailing whitespace"""
+    hint = min(max(hint, 0), len(lines))
+    if not block:
+        return hint
+    wanted = [line.rstrip() for line in block]
+    last = len(lines) - len(block)
+    for distance in range(len(lines) + 1):
+        for pos in (hint - distance, hint + distance):
+            if 0 <= pos <= last and all(
+                lines[pos + i].rstrip() == wanted[i] for i in range(len(block))
+            ):
+                return pos
+        if hint - distance < 0 and hint + distance > last:
+            break
+    return None
+
+
+def apply_unified_diff(text: str, patch: str) -> str:
+    """Apply a unified diff; hunks may be off by some lines but must match exactly"""
+    newline = "\r\n" if "\r\n" in text else "\n"
+    lines = text.splitlines()
+    ends_with_newline = text.endswith(("\n", "\r"))
+    shift = 0
+    for number, (old_start, old_lines, new_lines) in enumerate(
+        _parse_hunks(patch), start=1
+    ):
+        pos = _find_block(lines, old_lines, old_start - 1 + shift)
+        if pos is None:
+            raise ValueError(f"Hunk {number} does not match the current file content")
+        lines[pos : pos + len(old_lines)] = new_lines
+        shift = pos - (old_start - 1) + len(new_lines) - len(old_lines)
+    result = newline.join(lines)
+    return result + newline if ends_with_newline and lines else result
+
+
+def check_syntax(path: Path, old_text: str, new_text: str) -> None:
+    """Reject edits that break a Python or JSON file that was valid before"""
+
+    def valid(text):
+        try:
+            if path.suffix == ".py":
+                compile(text, str(path), "exec")
+            elif path.suffix == ".json":
+                json.loads(text)
+            return None
+        except (SyntaxError, ValueError) as e:
+            return e
+
+    error = valid(new_text)
+    if error is not None and valid(old_text) is None:
+        raise ValueError(f"The edit would break the {path.suffix} syntax: {error}")
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Write to a temporary file next to path and move it in place"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(tmp_path, path.stat().st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_verified(path: Path, old_text: str, new_text: str, encoding: str) -> str:
+    """Syntax-check, write atomically, read back and return a change summary"""
+    if new_text == old_text:
+        raise ValueError("The edit doesn't change the file")
+    check_syntax(path, old_text, new_text)
+    data = new_text.encode(encoding)
+    atomic_write(path, data)
+    if path.read_bytes() != data:
+        raise ValueError(f"'{path}' doesn't hold the expected content after writing")
+
+    added = removed = 0
+    for line in difflib.unified_diff(
+        old_text.splitlines(), new_text.splitlines(), lineterm="", n=0
+    ):
+        if line.startswith("+") and not line.startswith("+++"):
+            added += 1
+        elif line.startswith("-") and not line.startswith("---"):
+            removed += 1
+    return f"+{added}/-{removed} lines"
@@ -0,0 +1,149 @@
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+try:
+    # Optional: reading .zst files (pip install zstandard)
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+# Bytes looked at to classify a file
+SNIFF_BYTES = 8192
+
+# Lines returned by a single read when no max_lines is given
+DEFAULT_MAX_LINES = 2000
+
+# Lines per chunk when a read is streamed
+STREAM_BATCH_LINES = 200
+
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+BINARY_MAGIC = {
+    b"\x89PNG": "PNG image",
+    b"\xff\xd8\xff": "JPEG image",
+    b"GIF8": "GIF image",
+    b"%PDF": "PDF document",
+    b"PK\x03\x04": "ZIP archive",
+    b"\x7fELF": "ELF executable",
+    b"SQLite format 3": "SQLite database",
+}
+
+# Bytes that never show up in text files
+_TEXT_CONTROL = set(range(32)) - {8, 9, 10, 12, 13, 27}
+
+
+def _compression(head: bytes) -> Optional[str]:
+    for magic, kind in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def describe_binary(head: bytes) -> Optional[str]:
+    """Return a description if the sample looks binary, None for text"""
+    for magic, kind in BINARY_MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return None
+    if b"\0" in head:
+        return "binary data"
+    if head and sum(b in _TEXT_CONTROL for b in head) / len(head) > 0.1:
+        return "binary data"
+    return None
+
+
+def detect_encoding(head: bytes) -> str:
+    """Guess the text encoding from a sample of the file"""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # The sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        match = from_bytes(head).best()
+        if match is not None:
+            return match.encoding
+    return "latin-1"
+
+
+def _open_binary(path: Path, compression: Optional[str]):
+    """Open the file as a binary stream, decompressing on the fly"""
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    if compression == "xz":
+        return lzma.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("reading .zst files needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    return open(path, "rb")
+
+
+def iter_text_window(
+    path: Path,
+    start_line: int = 1,
+    max_lines: int = DEFAULT_MAX_LINES,
+    batch_lines: int = STREAM_BATCH_LINES,
+) -> Iterator[Tuple[str, int, bool, Optional[str]]]:
+    """
+    Read max_lines lines starting at start_line (1-based) in batches of
+    batch_lines, yielding (text, last_line, has_more, compression) per batch.
+    has_more is only set on the last batch, which is always yielded (empty
+    if the window is). Compressed files are decompressed as a stream, only
+    up to the end of the requested window.
+    Raises ValueError for binary content or a max_lines below 1.
+    """
+    if max_lines < 1:
+        raise ValueError(f"max_lines must be at least 1, got {max_lines}")
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    compression = _compression(head)
+
+    with _open_binary(path, compression) as raw:
+        buffered = io.BufferedReader(raw) if compression == "zstd" else raw
+        if compression:
+            head = buffered.peek(SNIFF_BYTES)[:SNIFF_BYTES]
+
+        kind = describe_binary(head)
+        if kind:
+            size = path.stat().st_size
+            raise ValueError(f"'{path}' is a binary file ({kind}, {size} bytes)")
+
+        text = io.TextIOWrapper(
+            buffered, encoding=detect_encoding(head), errors="replace"
+        )
+        start_line = max(start_line, 1)
+        last_line = start_line - 1
+        batch = []
+        for line in islice(text, start_line - 1, start_line - 1 + max_lines):
+            batch.append(line)
+            last_line += 1
+            if len(batch) == batch_lines:
+                yield "".join(batch), last_line, False, compression
+                batch = []
+        has_more = next(text, None) is not None
+        yield "".join(batch), last_line, has_more, compression
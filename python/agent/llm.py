@@ -1,25 +1,170 @@
 import json
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Any, List, Dict, Optional, Tuple
+from types import SimpleNamespace
+from typing import Any, Iterator, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
+from blob_store import BlobStore, OFFLOAD_THRESHOLD
+from search_index import shared_index
+from tool_cache import ToolResultCache, WorkspaceWarmer
+from tool_registry import ToolRegistry
+from token_counter import TokenCounter, UsageTotals
+from cancellation import CancellationToken, OperationCancelled
+from file_reader import DEFAULT_MAX_LINES, iter_text_window
+from file_editor import (
+    apply_search_replace,
+    apply_unified_diff,
+    diff_files,
+    read_for_edit,
+    write_verified,
+)
+from structured_output import get_validator, repair_schema, strict_schema
+from best_of_n import BestOfN, CandidateJudge, Scorer
+from request_layout import canonicalize
+from profiler import phase
+
 load_dotenv()
 
+# Context window sizes (in tokens) of the models used by the agent
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "llama3.2": 128000,
+    "claude-3-5-sonnet-20241022": 200000,
+}
+
+# Largest max_tokens value each model accepts
+MAX_OUTPUT_TOKENS = {
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+    "llama3.2": 4096,
+    "claude-3-5-sonnet-20241022": 8192,
+}
+
+# Default output budget per task type
+TASK_OUTPUT_BUDGETS = {
+    "tool_routing": 1024,
+    "answer": 4096,
+    "long_form": 8192,
+}
+
+# How many times a truncated response is continued before giving up
+MAX_CONTINUATIONS = 3
+
+CONTINUE_PROMPT = "Continue exactly where you left off, without repeating anything."
+
+# Tool results at least this long (in characters) are replaced by a reference
+# when an identical result is already in the history
+DEDUP_MIN_CHARS = 200
+
+DUPLICATE_RESULT = "[Identical to the result of tool call {} above]"
+
+# How many times invalid fields of a structured response are sent back for repair
+MAX_REPAIRS = 2
+
+
+class ResponseTruncated(Exception):
+    """Raised when tool call arguments are still cut off at the largest output budget"""
+
+
+REWRITE_PROMPT = """Rewrite the file below following these instructions:
+{instructions}
+
+Respond with only the complete new file content, without code fences or
+explanations, and keep everything the instructions don't ask to change as it is.
+
+{content}"""
+
+REPAIR_PROMPT = """These fields of your answer are invalid:
+{}
+Respond with only these fields, corrected."""
+
 
 class LLMInterface:
     """Unified interface for different LLM providers"""
 
-    def __init__(self, provider: str = "openai"):
+    def __init__(
+        self,
+        provider: str = "openai",
+        client: Any = None,
+        model: Optional[str] = None,
+        warm_up: bool = False,
+    ):
         self.provider = provider.lower()
+        # A pre-built client (e.g. a cassette replay client) skips the SDK setup
+        self.client = client
+        # Optional output sink (see output_sink.py) that receives the
+        # response text as it streams in
+        self.output_sink = None
+        # Directory for per-turn profiles (see profiler.py), None disables profiling
+        self.profile_dir = None
         # Files/patterns to ignore for security
         self.ignore_patterns = [".env"]
+        # edit_file and rewrite_file only write below this directory
+        self.workspace_root = Path(".").resolve()
+        # Large tool results are kept here instead of in the message history
+        self.blob_store = BlobStore()
+        # Trigram index for search_files, built in the background and
+        # shared with the other interfaces in this workspace
+        self.search_index = shared_index(Path("."), self._should_ignore_file)
+        # Results of list_files/read_file, valid while the path is unchanged
+        self.tool_cache = ToolResultCache()
+        # Fills tool_cache in the background until the first request is made
+        self.warmer = None
+        if warm_up:
+            self.warmer = WorkspaceWarmer(
+                Path("."),
+                self._should_ignore_file,
+                self._cached_list_files,
+                lambda filepath: "".join(self._cached_read_file(filepath)),
+            )
+            self.warmer.start()
+        # Embedding index for semantic_search, created on first use and
+        # shared with the other interfaces in this workspace
+        self.semantic_index = None
+        # tool call id -> (id of the identical earlier result, full content)
+        self.deduplicated: Dict[str, Tuple[str, str]] = {}
+        self.tool_registry = ToolRegistry()
+        self._register_tools()
         if self.provider == "openai":
             self._setup_openai()
         elif self.provider == "anthropic":
             self._setup_anthropic()
+        elif self.provider == "ollama":
+            self._setup_ollama()
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
+        # Same bytes on every request, so the prompt prefix stays cacheable
+        self.tools = canonicalize(self.tools)
+        if model:
+            self.model = model
+        # Local prompt token counts and per-session usage/cost totals
+        self.token_counter = TokenCounter(self.model)
+
+    @property
+    def usage(self) -> UsageTotals:
+        """Usage and cost totals of the session"""
+        return self.token_counter.usage
+
+    def spawn(self) -> "LLMInterface":
+        """A new interface with this one's client, model and settings, e.g. for sub-agents"""
+        child = LLMInterface(self.provider, client=self.client, model=self.model)
+        # In place, the diff_files handler holds on to the list
+        child.ignore_patterns[:] = self.ignore_patterns
+        child.workspace_root = self.workspace_root
+        child.blob_store = self.blob_store
+        child.semantic_index = self.semantic_index
+        return child
+
+    def stop_warm_up(self) -> None:
+        """Real traffic arrived, leave the disk to it"""
+        if self.warmer:
+            self.warmer.stop()
 
     def _should_ignore_file(self, filename: str) -> bool:
         """Check if a file should be ignored based on ignore patterns"""
@@ -28,12 +173,71 @@ class LLMInterface:
                 return True
         return False
 
+    def _register_tools(self):
+        """Register the handlers of the tools offered to the model"""
+        # Handlers that do heavy parsing pass cpu_bound=True (and a
+        # module-level function) to run in the shared process pool.
+        # Handlers returning an iterator stream their result in chunks
+        self.tool_registry.register(
+            "list_files", lambda args: self._cached_list_files(args.get("path", "."))
+        )
+        self.tool_registry.register(
+            "read_file",
+            lambda args: self._cached_read_file(
+                args.get("filepath", ""),
+                args.get("start_line", 1),
+                args.get("max_lines", DEFAULT_MAX_LINES),
+            ),
+        )
+        self.tool_registry.register(
+            "search_files",
+            lambda args: self.iter_search_files(
+                args.get("query", ""),
+                args.get("path", "."),
+                args.get("context_lines", 2),
+            ),
+        )
+        self.tool_registry.register(
+            "semantic_search",
+            lambda args: self.semantic_search(
+                args.get("query", ""), args.get("top_k", 5)
+            ),
+        )
+        self.tool_registry.register(
+            "diff_files",
+            partial(diff_files, ignore_patterns=self.ignore_patterns),
+            cpu_bound=True,
+        )
+        self.tool_registry.register(
+            "edit_file",
+            lambda args: self.edit_file(
+                args.get("filepath", ""), args.get("edits"), args.get("patch")
+            ),
+        )
+        self.tool_registry.register(
+            "rewrite_file",
+            lambda args, cancel_token: self.rewrite_file(
+                args.get("filepath", ""), args.get("instructions", ""), cancel_token
+            ),
+            cancellable=True,
+        )
+        self.tool_registry.register(
+            "read_blob",
+            lambda args: self.read_blob(
+                args.get("handle", ""),
+                args.get("start_line", 1),
+                args.get("end_line", 0),
+            ),
+        )
+
     def _setup_openai(self):
         """Setup OpenAI client and tools"""
         from openai import OpenAI
 
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if self.client is None:
+            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.model = "gpt-4o"
+        self.message_format = "openai"
         self.tools = [
             {
                 "type": "function",
@@ -56,27 +260,205 @@ class LLMInterface:
                 "type": "function",
                 "function": {
                     "name": "read_file",
-                    "description": "Read the contents of a file (cannot read files starting with .env for security)",
+                    "description": "Read the contents of a text file, also gzip/bz2/xz/zstd compressed ones (cannot read files starting with .env for security)",
                     "parameters": {
                         "type": "object",
                         "properties": {
                             "filepath": {
                                 "type": "string",
                                 "description": "The path to the file to read",
-                            }
+                            },
+                            "start_line": {
+                                "type": "integer",
+                                "description": "First line to read, 1-based (default: 1)",
+                            },
+                            "max_lines": {
+                                "type": "integer",
+                                "description": f"Maximum number of lines to read (default: {DEFAULT_MAX_LINES})",
+                            },
+                        },
+                        "required": ["filepath"],
+                    },
+                },
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "search_files",
+                    "description": "Search file contents for a text (case-insensitive) and return matching lines with context (excludes files starting with .env for security)",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "The text to search for",
+                            },
+                            "path": {
+                                "type": "string",
+                                "description": "The directory to search in (default: current directory)",
+                            },
+                            "context_lines": {
+                                "type": "integer",
+                                "description": "Number of lines of context around each match (default: 2)",
+                            },
+                        },
+                        "required": ["query"],
+                    },
+                },
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "semantic_search",
+                    "description": "Find the file passages most related to a natural language query (excludes files starting with .env for security)",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "What to look for, in natural language",
+                            },
+                            "top_k": {
+                                "type": "integer",
+                                "description": "Number of passages to return (default: 5)",
+                            },
+                        },
+                        "required": ["query"],
+                    },
+                },
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "read_blob",
+                    "description": "Read a line range of a large tool result that was stored as a blob",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "handle": {
+                                "type": "string",
+                                "description": "The blob handle given in the tool result",
+                            },
+                            "start_line": {
+                                "type": "integer",
+                                "description": "First line to read, 1-based (default: 1)",
+                            },
+                            "end_line": {
+                                "type": "integer",
+                                "description": "Last line to read, inclusive (default: end of blob)",
+                            },
+                        },
+                        "required": ["handle"],
+                    },
+                },
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "diff_files",
+                    "description": "Show the differences between two text files as a unified diff",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "old_path": {
+                                "type": "string",
+                                "description": "The path to the original file",
+                            },
+                            "new_path": {
+                                "type": "string",
+                                "description": "The path to the changed file",
+                            },
+                            "context_lines": {
+                                "type": "integer",
+                                "description": "Unchanged lines shown around each change (default: 3)",
+                            },
+                        },
+                        "required": ["old_path", "new_path"],
+                    },
+                },
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "edit_file",
+                    "description": "Edit a file with search/replace edits or a unified diff; prefer this over rewrite_file for small changes",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "filepath": {
+                                "type": "string",
+                                "description": "The path to the file to edit",
+                            },
+                            "edits": {
+                                "type": "array",
+                                "description": "Search/replace edits applied in order; each search text must occur exactly once in the file",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "search": {
+                                            "type": "string",
+                                            "description": "Exact text to replace, with enough lines to be unique",
+                                        },
+                                        "replace": {
+                                            "type": "string",
+                                            "description": "Text to put in its place",
+                                        },
+                                    },
+                                    "required": ["search", "replace"],
+                                },
+                            },
+                            "patch": {
+                                "type": "string",
+                                "description": "A unified diff of the file, instead of edits",
+                            },
                         },
                         "required": ["filepath"],
                     },
                 },
             },
+            {
+                "type": "function",
+                "function": {
+                    "name": "rewrite_file",
+                    "description": "Rewrite a whole file following instructions, for changes spread over most of the file",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "filepath": {
+                                "type": "string",
+                                "description": "The path to the file to rewrite",
+                            },
+                            "instructions": {
+                                "type": "string",
+                                "description": "What to change in the file",
+                            },
+                        },
+                        "required": ["filepath", "instructions"],
+                    },
+                },
+            },
         ]
 
+    def _setup_ollama(self):
+        """Setup a local Ollama model through its OpenAI compatible API"""
+        from openai import OpenAI
+
+        if self.client is None:
+            self.client = OpenAI(
+                base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"),
+                api_key="ollama",  # required by the client, ignored by Ollama
+            )
+        self._setup_openai()
+        self.model = "llama3.2"
+
     def _setup_anthropic(self):
         """Setup Anthropic client and tools"""
         from anthropic import Anthropic
 
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        if self.client is None:
+            self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         self.model = "claude-3-5-sonnet-20241022"
+        self.message_format = "anthropic"
         self.tools = [
             {
                 "name": "list_files",
@@ -94,38 +476,309 @@ class LLMInterface:
             },
             {
                 "name": "read_file",
-                "description": "Read the contents of a file (cannot read files starting with .env for security)",
+                "description": "Read the contents of a text file, also gzip/bz2/xz/zstd compressed ones (cannot read files starting with .env for security)",
                 "input_schema": {
                     "type": "object",
                     "properties": {
                         "filepath": {
                             "type": "string",
                             "description": "The path to the file to read",
-                        }
+                        },
+                        "start_line": {
+                            "type": "integer",
+                            "description": "First line to read, 1-based (default: 1)",
+                        },
+                        "max_lines": {
+                            "type": "integer",
+                            "description": f"Maximum number of lines to read (default: {DEFAULT_MAX_LINES})",
+                        },
                     },
                     "required": ["filepath"],
                 },
             },
+            {
+                "name": "search_files",
+                "description": "Search file contents for a text (case-insensitive) and return matching lines with context (excludes files starting with .env for security)",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "The text to search for",
+                        },
+                        "path": {
+                            "type": "string",
+                            "description": "The directory to search in (default: current directory)",
+                        },
+                        "context_lines": {
+                            "type": "integer",
+                            "description": "Number of lines of context around each match (default: 2)",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            },
+            {
+                "name": "semantic_search",
+                "description": "Find the file passages most related to a natural language query (excludes files starting with .env for security)",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "What to look for, in natural language",
+                        },
+                        "top_k": {
+                            "type": "integer",
+                            "description": "Number of passages to return (default: 5)",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            },
+            {
+                "name": "read_blob",
+                "description": "Read a line range of a large tool result that was stored as a blob",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "handle": {
+                            "type": "string",
+                            "description": "The blob handle given in the tool result",
+                        },
+                        "start_line": {
+                            "type": "integer",
+                            "description": "First line to read, 1-based (default: 1)",
+                        },
+                        "end_line": {
+                            "type": "integer",
+                            "description": "Last line to read, inclusive (default: end of blob)",
+                        },
+                    },
+                    "required": ["handle"],
+                },
+            },
+            {
+                "name": "diff_files",
+                "description": "Show the differences between two text files as a unified diff",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "old_path": {
+                            "type": "string",
+                            "description": "The path to the original file",
+                        },
+                        "new_path": {
+                            "type": "string",
+                            "description": "The path to the changed file",
+                        },
+                        "context_lines": {
+                            "type": "integer",
+                            "description": "Unchanged lines shown around each change (default: 3)",
+                        },
+                    },
+                    "required": ["old_path", "new_path"],
+                },
+            },
+            {
+                "name": "edit_file",
+                "description": "Edit a file with search/replace edits or a unified diff; prefer this over rewrite_file for small changes",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "filepath": {
+                            "type": "string",
+                            "description": "The path to the file to edit",
+                        },
+                        "edits": {
+                            "type": "array",
+                            "description": "Search/replace edits applied in order; each search text must occur exactly once in the file",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "search": {
+                                        "type": "string",
+                                        "description": "Exact text to replace, with enough lines to be unique",
+                                    },
+                                    "replace": {
+                                        "type": "string",
+                                        "description": "Text to put in its place",
+                                    },
+                                },
+                                "required": ["search", "replace"],
+                            },
+                        },
+                        "patch": {
+                            "type": "string",
+                            "description": "A unified diff of the file, instead of edits",
+                        },
+                    },
+                    "required": ["filepath"],
+                },
+            },
+            {
+                "name": "rewrite_file",
+                "description": "Rewrite a whole file following instructions, for changes spread over most of the file",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "filepath": {
+                            "type": "string",
+                            "description": "The path to the file to rewrite",
+                        },
+                        "instructions": {
+                            "type": "string",
+                            "description": "What to change in the file",
+                        },
+                    },
+                    "required": ["filepath", "instructions"],
+                },
+            },
         ]
 
     def create_completion(
-        self, messages: List[Dict], system_prompt: str
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Tuple[Optional[str], Optional[List[Dict]]]:
         """
         Create a completion and return (response_text, tool_calls)
         Returns (None, tool_calls) if tools need to be executed
         Returns (response_text, None) if no tools needed
+
+        task_type selects the output budget (see TASK_OUTPUT_BUDGETS)
+        Raises OperationCancelled (with the partial text) if cancel_token is
+        cancelled while the response is streaming in, and ResponseTruncated
+        if a tool call doesn't fit even the largest output budget
         """
-        if self.provider == "openai":
-            return self._create_openai_completion(messages, system_prompt)
-        else:
-            return self._create_anthropic_completion(messages, system_prompt)
+        self.stop_warm_up()
+        with phase("provider"):
+            messages = self._restore_duplicates(messages)
+            if self.message_format == "openai":
+                return self._create_openai_completion(
+                    messages, system_prompt, task_type, cancel_token
+                )
+            else:
+                return self._create_anthropic_completion(
+                    messages, system_prompt, task_type, cancel_token
+                )
 
-    def _create_openai_completion(
+    def _estimate_prompt_tokens(self, messages: List[Dict], system_prompt: str) -> int:
+        """Count the prompt tokens locally before sending the request"""
+        return self.token_counter.count_prompt(messages, system_prompt, self.tools)
+
+    def _pick_max_tokens(
+        self, messages: List[Dict], system_prompt: str, task_type: str
+    ) -> int:
+        """Pick max_tokens from the task type and the remaining context window"""
+        budget = TASK_OUTPUT_BUDGETS.get(task_type, TASK_OUTPUT_BUDGETS["answer"])
+        budget = min(budget, MAX_OUTPUT_TOKENS.get(self.model, budget))
+
+        context_window = CONTEXT_WINDOWS.get(self.model)
+        if context_window:
+            remaining = context_window - self._estimate_prompt_tokens(
+                messages, system_prompt
+            )
+            if remaining <= 0:
+                raise ValueError(
+                    f"Prompt does not fit into the {context_window} token context window"
+                )
+            budget = min(budget, remaining)
+
+        return budget
+
+    def _consume_stream(self, stream, handle_chunk, cancel_token, partial_text):
+        """
+        Feed every chunk of a response stream to handle_chunk.
+        The stream is always closed at the end, which releases the pooled
+        connection, and cancel_token closes it early from any thread.
+        """
+        if cancel_token:
+            cancel_token.on_cancel(stream.close)
+        try:
+            for chunk in stream:
+                if cancel_token and cancel_token.cancelled:
+                    break
+                handle_chunk(chunk)
+        except Exception:
+            # Closing the stream from another thread interrupts the read
+            if not (cancel_token and cancel_token.cancelled):
+                raise
+        finally:
+            stream.close()
+            if self.output_sink:
+                self.output_sink.flush()
+            if cancel_token:
+                cancel_token.remove_callback(stream.close)
+
+        if cancel_token:
+            cancel_token.raise_if_cancelled(partial_text())
+
+    def _stream_openai_response(
+        self,
+        messages: List[Dict],
+        max_tokens: int,
+        cancel_token,
+        request_options: Optional[Dict] = None,
+    ) -> Dict:
+        """
+        Stream an OpenAI response and collect it into a dict
+        request_options override request parameters, None removes one
+        """
+        result = {"content": "", "tool_calls": [], "finish_reason": None}
+
+        def handle_chunk(chunk):
+            if chunk.usage:
+                result["usage"] = chunk.usage
+                self.token_counter.record_usage(chunk.usage)
+            if not chunk.choices:
+                return
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                result["finish_reason"] = choice.finish_reason
+            self._add_openai_delta(result, choice.delta)
+            if choice.delta.content and self.output_sink:
+                self.output_sink.write(choice.delta.content)
+
+        params = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": messages,
+            "tools": self.tools,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        params.update(request_options or {})
+        # Type ignore since we know self.client is OpenAI client in this context
+        stream = self.client.chat.completions.create(  # type: ignore
+            **{k: v for k, v in params.items() if v is not None}
+        )
+        self._consume_stream(
+            stream, handle_chunk, cancel_token, lambda: result["content"]
+        )
+        return result
+
+    def _add_openai_delta(self, result: Dict, delta) -> None:
+        """Add the text and tool call pieces of a streamed delta to result"""
+        if delta.content:
+            result["content"] += delta.content
+        for tool_chunk in delta.tool_calls or []:
+            if len(result["tool_calls"]) <= tool_chunk.index:
+                result["tool_calls"].append({"id": "", "name": "", "arguments": ""})
+            tc = result["tool_calls"][tool_chunk.index]
+            if tool_chunk.id:
+                tc["id"] += tool_chunk.id
+            if tool_chunk.function.name:
+                tc["name"] += tool_chunk.function.name
+            if tool_chunk.function.arguments:
+                tc["arguments"] += tool_chunk.function.arguments
+
+    def _format_openai_messages(
         self, messages: List[Dict], system_prompt: str
-    ) -> Tuple[Optional[str], Optional[List[Dict]]]:
-        """Handle OpenAI completion"""
-        # Convert messages to proper format for OpenAI
+    ) -> List[Dict]:
+        """The system prompt followed by the history, as sent to OpenAI"""
         formatted_messages = []
         if system_prompt:
             formatted_messages.append({"role": "system", "content": system_prompt})
@@ -134,80 +787,568 @@ class LLMInterface:
             if msg["role"] == "system":
                 continue  # Already added
             else:
-                formatted_messages.append(msg)
+                # Fixed key order, so earlier turns serialize to the same bytes
+                formatted_messages.append(canonicalize(msg))
+        return formatted_messages
 
-        # Type ignore since we know self.client is OpenAI client in this context
-        response = self.client.chat.completions.create(  # type: ignore
-            model=self.model,
-            max_tokens=1024,
-            messages=formatted_messages,  # type: ignore
-            tools=self.tools,  # type: ignore
-        )
+    def _create_openai_completion(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Tuple[Optional[str], Optional[List[Dict]]]:
+        """Handle OpenAI completion"""
+        formatted_messages = self._format_openai_messages(messages, system_prompt)
+
+        # Counted from the caller's messages, which may have cached encodings
+        prompt_messages = messages
+        text_parts = []
+        for attempt in range(MAX_CONTINUATIONS + 1):
+            max_tokens = self._pick_max_tokens(
+                prompt_messages, system_prompt, task_type
+            )
+            try:
+                response = self._stream_openai_response(
+                    formatted_messages, max_tokens, cancel_token
+                )
+            except OperationCancelled as e:
+                raise OperationCancelled("".join(text_parts) + e.partial_text)
+
+            if response["finish_reason"] != "length" or attempt == MAX_CONTINUATIONS:
+                break
 
-        tool_calls = response.choices[0].message.tool_calls
+            if response["tool_calls"]:
+                # Truncated tool call arguments can't be continued, retry
+                # once with the largest output budget instead
+                if task_type == "long_form":
+                    break
+                task_type = "long_form"
+                continue
+
+            # Cut off mid-answer: keep the partial text and ask the model
+            # to continue from it instead of starting over
+            partial = response["content"]
+            text_parts.append(partial)
+            continuation = [
+                {"role": "assistant", "content": partial},
+                {"role": "user", "content": CONTINUE_PROMPT},
+            ]
+            formatted_messages = formatted_messages + continuation
+            prompt_messages = prompt_messages + continuation
+
+        tool_calls = response["tool_calls"]
+        if tool_calls and response["finish_reason"] == "length":
+            raise ResponseTruncated(
+                f"Tool call arguments exceeded {max_tokens} output tokens"
+            )
         if tool_calls:
             # Convert OpenAI tool calls to unified format
             unified_tool_calls = []
             for tc in tool_calls:
                 unified_tool_calls.append(
                     {
-                        "id": tc.id,
-                        "name": tc.function.name,
-                        "args": json.loads(tc.function.arguments),
+                        "id": tc["id"],
+                        "name": tc["name"],
+                        "args": json.loads(tc["arguments"] or "{}"),
                     }
                 )
             return None, unified_tool_calls
         else:
-            return response.choices[0].message.content, None
+            # Stitch any continued parts together
+            text_parts.append(response["content"])
+            return "".join(text_parts), None
+
+    def _stream_anthropic_response(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        max_tokens: int,
+        cancel_token,
+        request_options: Optional[Dict] = None,
+    ) -> Dict:
+        """
+        Stream an Anthropic response and collect it into a dict
+        request_options override request parameters, None removes one
+        """
+        result = {"blocks": [], "stop_reason": None}
+        usage = SimpleNamespace(
+            input_tokens=0, output_tokens=0, cache_read_input_tokens=0
+        )
+
+        def handle_chunk(event):
+            if event.type == "message_start":
+                usage.input_tokens = event.message.usage.input_tokens
+                usage.cache_read_input_tokens = (
+                    event.message.usage.cache_read_input_tokens or 0
+                )
+            elif event.type == "content_block_start":
+                block = event.content_block
+                if block.type == "tool_use":
+                    result["blocks"].append(
+                        {
+                            "type": "tool_use",
+                            "id": block.id,
+                            "name": block.name,
+                            "input": "",
+                        }
+                    )
+                else:
+                    result["blocks"].append({"type": "text", "text": ""})
+            elif event.type == "content_block_delta":
+                block = result["blocks"][event.index]
+                if event.delta.type == "text_delta":
+                    block["text"] += event.delta.text
+                    if self.output_sink:
+                        self.output_sink.write(event.delta.text)
+                elif event.delta.type == "input_json_delta":
+                    block["input"] += event.delta.partial_json
+            elif event.type == "message_delta":
+                result["stop_reason"] = event.delta.stop_reason
+                usage.output_tokens = event.usage.output_tokens
+
+        def partial_text():
+            return "".join(b["text"] for b in result["blocks"] if b["type"] == "text")
+
+        params = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": messages,
+            "system": system_prompt,
+            "tools": self.tools,
+            "stream": True,
+        }
+        params.update(request_options or {})
+        # Type ignore since we know self.client is Anthropic client in this context
+        stream = self.client.messages.create(  # type: ignore
+            **{k: v for k, v in params.items() if v is not None}
+        )
+        try:
+            self._consume_stream(stream, handle_chunk, cancel_token, partial_text)
+        finally:
+            self.token_counter.record_usage(usage)
+
+        for block in result["blocks"]:
+            if block["type"] == "tool_use":
+                block["input"] = json.loads(block["input"] or "{}")
+        return result
 
     def _create_anthropic_completion(
-        self, messages: List[Dict], system_prompt: str
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Tuple[Optional[str], Optional[List[Dict]]]:
         """Handle Anthropic completion"""
         # Filter out system messages from the message list
         user_messages = [msg for msg in messages if msg["role"] != "system"]
 
-        # Type ignore since we know self.client is Anthropic client in this context
-        response = self.client.messages.create(  # type: ignore
-            model=self.model,
-            max_tokens=1024,
-            messages=user_messages,  # type: ignore
-            system=system_prompt,
-            tools=self.tools,  # type: ignore
-        )
+        partial = ""
+        for attempt in range(MAX_CONTINUATIONS + 1):
+            request_messages = user_messages
+            if partial:
+                # Prefill the assistant turn so the model continues the
+                # partial output (trailing whitespace is not allowed there)
+                partial = partial.rstrip()
+                request_messages = user_messages + [
+                    {"role": "assistant", "content": partial}
+                ]
+
+            max_tokens = self._pick_max_tokens(
+                request_messages if partial else messages, system_prompt, task_type
+            )
+            try:
+                response = self._stream_anthropic_response(
+                    request_messages, system_prompt, max_tokens, cancel_token
+                )
+            except OperationCancelled as e:
+                raise OperationCancelled(partial + e.partial_text)
+            except json.JSONDecodeError:
+                # Tool input cut off by max_tokens, retried below
+                response = {
+                    "blocks": [{"type": "tool_use"}],
+                    "stop_reason": "max_tokens",
+                }
 
-        if response.stop_reason == "tool_use":
+            if response["stop_reason"] != "max_tokens" or attempt == MAX_CONTINUATIONS:
+                break
+
+            if any(block["type"] == "tool_use" for block in response["blocks"]):
+                # Truncated tool input can't be continued, retry once with
+                # the largest output budget instead
+                if task_type == "long_form":
+                    break
+                task_type = "long_form"
+                continue
+
+            partial += "".join(
+                block["text"] for block in response["blocks"] if block["type"] == "text"
+            )
+
+        if response["stop_reason"] == "max_tokens" and any(
+            block["type"] == "tool_use" for block in response["blocks"]
+        ):
+            raise ResponseTruncated(
+                f"Tool call input exceeded {max_tokens} output tokens"
+            )
+
+        if response["stop_reason"] == "tool_use":
             # Extract tool calls and any text
             text_parts = []
             tool_calls = []
 
-            for block in response.content:
-                if block.type == "text":
-                    text_parts.append(block.text)
-                elif block.type == "tool_use":
+            for block in response["blocks"]:
+                if block["type"] == "text":
+                    text_parts.append(block["text"])
+                elif block["type"] == "tool_use":
                     tool_calls.append(
-                        {"id": block.id, "name": block.name, "args": block.input}
+                        {
+                            "id": block["id"],
+                            "name": block["name"],
+                            "args": block["input"],
+                        }
                     )
 
-            # Print any text that came with tool calls
-            if text_parts:
+            # Print any text that came with tool calls (already streamed
+            # if there is an output sink)
+            if text_parts and not self.output_sink:
                 print("".join(text_parts), end="", flush=True)
 
             return None, tool_calls
         else:
             # Extract text from response
-            text_parts = []
-            for block in response.content:
-                if block.type == "text":
-                    text_parts.append(block.text)
+            text_parts = [partial]
+            for block in response["blocks"]:
+                if block["type"] == "text":
+                    text_parts.append(block["text"])
 
             return "".join(text_parts), None
 
+    def create_structured_completion(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        schema: Any,
+        name: str = "response",
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Any:
+        """
+        Create a completion that follows schema, a JSON Schema dict or a
+        pydantic model class, and return the validated dict (or model).
+        Uses strict response_format with OpenAI and a forced tool call with
+        Anthropic. Invalid fields, and only those, are sent back for repair;
+        raises ValueError if they are still invalid after MAX_REPAIRS tries.
+        """
+        validator = get_validator(schema)
+        schema = validator.schema
+        value = self._request_structured(
+            messages, system_prompt, schema, name, cancel_token
+        )
+        for attempt in range(MAX_REPAIRS + 1):
+            errors = validator.errors(value)
+            if not errors:
+                return validator.parse(value)
+            if attempt == MAX_REPAIRS:
+                break
+
+            properties = schema.get("properties", {})
+            fields = sorted({path[0] for path, _ in errors if path} & set(properties))
+            if not isinstance(value, dict) or not fields:
+                # Nothing to patch, ask for the whole object again
+                value = self._request_structured(
+                    messages, system_prompt, schema, name, cancel_token
+                )
+                continue
+
+            # Fields the schema doesn't know about are dropped, not repaired
+            value = {k: v for k, v in value.items() if k in properties}
+            details = "\n".join(
+                f"- {'.'.join(map(str, path))}: {message}"
+                for path, message in errors
+                if path and path[0] in fields
+            )
+            repair_messages = messages + [
+                {
+                    "role": "assistant",
+                    "content": json.dumps({f: value.get(f) for f in fields}),
+                },
+                {"role": "user", "content": REPAIR_PROMPT.format(details)},
+            ]
+            patch = self._request_structured(
+                repair_messages,
+                system_prompt,
+                repair_schema(schema, fields),
+                name,
+                cancel_token,
+            )
+            if isinstance(patch, dict):
+                value.update({k: v for k, v in patch.items() if k in fields})
+
+        raise ValueError(
+            "Structured response is still invalid: "
+            + "; ".join(f"{'.'.join(map(str, p)) or '<root>'}: {m}" for p, m in errors)
+        )
+
+    def _request_structured(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        schema: Dict,
+        name: str,
+        cancel_token: Optional[CancellationToken],
+    ) -> Any:
+        """Send one structured request, returns the parsed JSON or None"""
+        # The raw JSON isn't meant for the user, keep it off the output sink
+        output_sink, self.output_sink = self.output_sink, None
+        try:
+            if self.message_format == "openai":
+                formatted_messages = self._format_openai_messages(
+                    messages, system_prompt
+                )
+                max_tokens = self._pick_max_tokens(formatted_messages, "", "answer")
+                response_format = {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": name,
+                        "schema": strict_schema(schema),
+                        "strict": True,
+                    },
+                }
+                response = self._stream_openai_response(
+                    formatted_messages,
+                    max_tokens,
+                    cancel_token,
+                    {"tools": None, "response_format": response_format},
+                )
+                return json.loads(response["content"])
+            else:
+                user_messages = [m for m in messages if m["role"] != "system"]
+                max_tokens = self._pick_max_tokens(
+                    user_messages, system_prompt, "answer"
+                )
+                tool = {
+                    "name": name,
+                    "description": "Respond with the result",
+                    "input_schema": schema,
+                }
+                response = self._stream_anthropic_response(
+                    user_messages,
+                    system_prompt,
+                    max_tokens,
+                    cancel_token,
+                    {"tools": [tool], "tool_choice": {"type": "tool", "name": name}},
+                )
+                for block in response["blocks"]:
+                    if block["type"] == "tool_use":
+                        return block["input"]
+                return None
+        except json.JSONDecodeError:
+            # Cut off by max_tokens or not JSON at all
+            return None
+        finally:
+            self.output_sink = output_sink
+
+    def create_completions_n(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        n: int = 3,
+        scorer: Optional[Scorer] = None,
+        accept_score: Optional[float] = None,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> BestOfN:
+        """
+        Sample n candidates at once (OpenAI n parameter, parallel Anthropic
+        calls) and return the best. scorer(text, tool_calls) runs as each one
+        finishes and returns a score, or None for an invalid candidate; the
+        first one reaching accept_score (without one: the first valid one)
+        wins and the remaining streams are closed. Candidates cut off by
+        max_tokens are invalid, they are not continued. Raises ValueError if
+        no candidate is valid.
+        """
+        judge = CandidateJudge(scorer, accept_score)
+        usage = self.token_counter.usage
+        before = (usage.input_tokens, usage.output_tokens, usage.cost)
+        # Closes the remaining streams once a winner is found
+        stop = CancellationToken()
+        if cancel_token:
+            cancel_token.on_cancel(stop.cancel)
+        # Candidates aren't meant for the user, only the winner is written out
+        output_sink, self.output_sink = self.output_sink, None
+        try:
+            if self.message_format == "openai":
+                self._sample_openai(messages, system_prompt, n, task_type, judge, stop)
+            else:
+                self._sample_anthropic(
+                    messages, system_prompt, n, task_type, judge, stop
+                )
+        finally:
+            self.output_sink = output_sink
+            if cancel_token:
+                cancel_token.remove_callback(stop.cancel)
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+
+        winner = judge.best()
+        if winner is None:
+            raise ValueError(f"None of the {n} candidates was valid")
+        if winner.text and self.output_sink:
+            self.output_sink.write(winner.text)
+            self.output_sink.flush()
+        return BestOfN(
+            text=winner.text,
+            tool_calls=winner.tool_calls,
+            score=winner.score,
+            candidates=judge.candidates,
+            requested=n,
+            latency=judge.selected_at - judge.started,
+            input_tokens=usage.input_tokens - before[0],
+            output_tokens=usage.output_tokens - before[1],
+            cost=usage.cost - before[2],
+        )
+
+    def _sample_openai(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        n: int,
+        task_type: str,
+        judge: CandidateJudge,
+        stop: CancellationToken,
+    ) -> None:
+        """One streamed request with n choices, each judged when it finishes"""
+        formatted_messages = self._format_openai_messages(messages, system_prompt)
+        prompt_tokens = self._estimate_prompt_tokens(messages, system_prompt)
+        max_tokens = self._pick_max_tokens(messages, system_prompt, task_type)
+        choices: Dict[int, Dict] = {}
+        usage_reported = []
+
+        def handle_chunk(chunk):
+            if chunk.usage:
+                usage_reported.append(chunk.usage)
+                self.token_counter.record_usage(chunk.usage)
+            for choice in chunk.choices:
+                result = choices.setdefault(
+                    choice.index, {"content": "", "tool_calls": []}
+                )
+                self._add_openai_delta(result, choice.delta)
+                if not choice.finish_reason:
+                    continue
+                try:
+                    tool_calls = [
+                        {
+                            "id": tc["id"],
+                            "name": tc["name"],
+                            "args": json.loads(tc["arguments"] or "{}"),
+                        }
+                        for tc in result["tool_calls"]
+                    ]
+                except json.JSONDecodeError:
+                    continue
+                truncated = choice.finish_reason == "length"
+                if tool_calls:
+                    done = judge.add(choice.index, None, tool_calls, truncated)
+                else:
+                    done = judge.add(choice.index, result["content"], None, truncated)
+                if done:
+                    stop.cancel()
+
+        # Type ignore since we know self.client is OpenAI client in this context
+        stream = self.client.chat.completions.create(  # type: ignore
+            model=self.model,
+            max_tokens=max_tokens,
+            messages=formatted_messages,  # type: ignore
+            tools=self.tools,  # type: ignore
+            n=n,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            self._consume_stream(stream, handle_chunk, stop, lambda: "")
+        except OperationCancelled:
+            pass
+        if not usage_reported:
+            # Stopped before the usage chunk: count what was generated so far
+            generated = "".join(
+                r["content"] + "".join(tc["arguments"] for tc in r["tool_calls"])
+                for r in choices.values()
+            )
+            self.token_counter.record_usage(
+                SimpleNamespace(
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=self.token_counter.count_text(generated),
+                )
+            )
+
+    def _sample_anthropic(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        n: int,
+        task_type: str,
+        judge: CandidateJudge,
+        stop: CancellationToken,
+    ) -> None:
+        """n parallel requests, each judged when it finishes"""
+        user_messages = [m for m in messages if m["role"] != "system"]
+        max_tokens = self._pick_max_tokens(messages, system_prompt, task_type)
+        errors = []
+
+        def sample(index):
+            token = CancellationToken()
+            stop.on_cancel(token.cancel)
+            try:
+                response = self._stream_anthropic_response(
+                    user_messages, system_prompt, max_tokens, token
+                )
+            except (OperationCancelled, json.JSONDecodeError):
+                return
+            except Exception as e:
+                errors.append(e)
+                return
+            finally:
+                stop.remove_callback(token.cancel)
+
+            tool_calls = [
+                {"id": b["id"], "name": b["name"], "args": b["input"]}
+                for b in response["blocks"]
+                if b["type"] == "tool_use"
+            ]
+            truncated = response["stop_reason"] == "max_tokens"
+            if tool_calls:
+                done = judge.add(index, None, tool_calls, truncated)
+            else:
+                text = "".join(
+                    b["text"] for b in response["blocks"] if b["type"] == "text"
+                )
+                done = judge.add(index, text, None, truncated)
+            if done:
+                stop.cancel()
+
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            list(pool.map(sample, range(n)))
+        if errors and not judge.candidates:
+            raise errors[0]
+
     def add_tool_response(
         self, messages: List[Dict], tool_call: Dict, result: str
     ) -> None:
         """Add a tool response to the message history in the correct format"""
-        if self.provider == "openai":
+        if len(result) > OFFLOAD_THRESHOLD and tool_call["name"] != "read_blob":
+            # Keep only a summary and a handle in the history
+            result = self.blob_store.offload(result)
+
+        if len(result) >= DEDUP_MIN_CHARS:
+            for entry, call_id in self._tool_results(messages):
+                if entry["content"] == result:
+                    # Same bytes as an earlier result, don't send them twice
+                    self.deduplicated[tool_call["id"]] = (call_id, result)
+                    result = DUPLICATE_RESULT.format(call_id)
+                    break
+
+        if self.message_format == "openai":
             # Add the tool result
             messages.append(
                 {
@@ -232,11 +1373,69 @@ class LLMInterface:
                 }
             )
 
+    def _tool_results(self, messages: List[Dict]):
+        """Yield (entry, tool_call_id) for each tool result in the history"""
+        for msg in messages:
+            if msg["role"] == "tool":
+                yield msg, msg["tool_call_id"]
+            elif msg["role"] == "user" and isinstance(msg["content"], list):
+                for block in msg["content"]:
+                    if block.get("type") == "tool_result":
+                        yield block, block["tool_use_id"]
+
+    def _restore_duplicates(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Copy of messages with the full content put back where the referenced
+        result was dropped. The stored messages are shared (e.g. between
+        Conversation branches) and are left as they are.
+        """
+        if not self.deduplicated:
+            return messages
+        present = set()
+        # id of the dropped original -> id of the result restored in its place
+        replaced = {}
+        # id() of the entry -> content to send instead
+        restored = {}
+        for entry, call_id in self._tool_results(messages):
+            if call_id not in self.deduplicated:
+                present.add(call_id)
+                continue
+            original_id, content = self.deduplicated[call_id]
+            if original_id in present:
+                continue
+            if original_id in replaced:
+                restored[id(entry)] = DUPLICATE_RESULT.format(replaced[original_id])
+            else:
+                restored[id(entry)] = content
+                replaced[original_id] = call_id
+                present.add(call_id)
+        if not restored:
+            return messages
+
+        request_messages = []
+        for msg in messages:
+            if id(msg) in restored:
+                msg = {**msg, "content": restored[id(msg)]}
+            elif isinstance(msg.get("content"), list) and any(
+                id(block) in restored for block in msg["content"]
+            ):
+                content = [
+                    (
+                        {**block, "content": restored[id(block)]}
+                        if id(block) in restored
+                        else block
+                    )
+                    for block in msg["content"]
+                ]
+                msg = {**msg, "content": content}
+            request_messages.append(msg)
+        return request_messages
+
     def add_assistant_message_with_tools(
         self, messages: List[Dict], tool_calls: List[Dict]
     ) -> None:
         """Add assistant message with tool calls (needed for OpenAI format)"""
-        if self.provider == "openai":
+        if self.message_format == "openai":
             # Convert unified tool calls back to OpenAI format
             openai_tool_calls = []
             for tc in tool_calls:
@@ -267,6 +1466,22 @@ class LLMInterface:
 
             messages.append({"role": "assistant", "content": content})
 
+    def _cached_list_files(self, path: str = ".") -> str:
+        return self.tool_cache.cached(
+            "list_files", path, lambda: self.list_files_filtered(path)
+        )
+
+    def _cached_read_file(
+        self, filepath: str, start_line: int = 1, max_lines: int = DEFAULT_MAX_LINES
+    ) -> Iterator[str]:
+        return self.tool_cache.cached_stream(
+            "read_file",
+            filepath,
+            lambda: self.iter_read_file(filepath, start_line, max_lines),
+            start_line,
+            max_lines,
+        )
+
     def list_files_filtered(self, path: str = ".") -> str:
         """List files and directories with filtering applied"""
         try:
@@ -306,25 +1521,250 @@ class LLMInterface:
         except Exception as e:
             return f"Error listing files: {str(e)}"
 
-    def read_file_filtered(self, filepath: str) -> str:
+    def search_files_filtered(
+        self, query: str, path: str = ".", context_lines: int = 2
+    ) -> str:
+        """Search file contents with filtering applied"""
+        return "".join(self.iter_search_files(query, path, context_lines))
+
+    def iter_search_files(
+        self, query: str, path: str = ".", context_lines: int = 2
+    ) -> Iterator[str]:
+        """search_files_filtered in chunks, one per match"""
+        if not query:
+            yield "Error: Search query is empty"
+            return
+        if not Path(path).exists():
+            yield f"Error: Path '{path}' does not exist"
+            return
+        try:
+            yield from self.search_index.iter_search(query, path, context_lines)
+        except Exception as e:
+            yield f"\nError searching files: {str(e)}"
+
+    def semantic_search(self, query: str, top_k: int = 5) -> str:
+        """Return the file passages closest to the query in embedding space"""
+        try:
+            if not query:
+                return "Error: Search query is empty"
+            if self.semantic_index is None:
+                from semantic_index import shared_semantic_index
+
+                self.semantic_index = shared_semantic_index(self.search_index)
+
+            matches = self.semantic_index.search(query, top_k)
+            if not matches:
+                return f"No passages found for '{query}'"
+
+            result = f"Passages related to '{query}':"
+            for match in matches:
+                lines = (
+                    Path(match["path"])
+                    .read_text(encoding="utf-8", errors="replace")
+                    .splitlines()
+                )
+                text = "\n".join(lines[match["start_line"] - 1 : match["end_line"]])
+                result += (
+                    f"\n\n--- {match['path']} (lines {match['start_line']}-"
+                    f"{match['end_line']}, score {match['score']:.2f}) ---\n{text}"
+                )
+            return result
+        except Exception as e:
+            return f"Error in semantic search: {str(e)}"
+
+    def read_blob(self, handle: str, start_line: int = 1, end_line: int = 0) -> str:
+        """Read a line range of an offloaded tool result"""
+        try:
+            return self.blob_store.read_lines(handle, start_line, end_line)
+        except Exception as e:
+            return f"Error reading blob: {str(e)}"
+
+    def read_file_filtered(
+        self, filepath: str, start_line: int = 1, max_lines: int = DEFAULT_MAX_LINES
+    ) -> str:
         """Read file contents with filtering applied"""
+        return "".join(self.iter_read_file(filepath, start_line, max_lines))
+
+    def iter_read_file(
+        self, filepath: str, start_line: int = 1, max_lines: int = DEFAULT_MAX_LINES
+    ) -> Iterator[str]:
+        """read_file_filtered in chunks of STREAM_BATCH_LINES lines"""
+        file_path = Path(filepath)
+
+        # Check if file should be ignored
+        if self._should_ignore_file(file_path.name):
+            yield f"Error: Access to '{filepath}' is restricted for security reasons"
+            return
+
+        if max_lines < 1:
+            yield f"Error: max_lines must be at least 1, got {max_lines}"
+            return
+
+        if not file_path.exists():
+            yield f"Error: File '{filepath}' does not exist"
+            return
+
+        if file_path.is_dir():
+            yield f"Error: '{filepath}' is a directory, not a file"
+            return
+
+        # The header goes out before it is known how far the window reaches
+        started = False
+        try:
+            for content, last_line, has_more, compression in iter_text_window(
+                file_path, start_line, max_lines
+            ):
+                if not started:
+                    header = f"Contents of '{filepath}'"
+                    if compression:
+                        header += f" ({compression} decompressed)"
+                    if start_line > 1:
+                        header += f", from line {start_line}"
+                    yield f"{header}:\n```\n"
+                    started = True
+                yield content
+        except ValueError as e:
+            yield f"Error: {str(e)}"
+            return
+        except Exception as e:
+            prefix = "\n" if started else ""
+            yield f"{prefix}Error reading file: {str(e)}"
+            return
+
+        yield "\n```"
+        if has_more:
+            yield (
+                f"\n(Showed lines {max(start_line, 1)}-{last_line}, file continues, "
+                f"read again with start_line={last_line + 1})"
+            )
+
+    def _check_editable(self, filepath: str) -> Optional[str]:
+        """Error message if the file may not be edited, None otherwise"""
+        file_path = Path(filepath)
+        if self._should_ignore_file(file_path.name):
+            return f"Error: Access to '{filepath}' is restricted for security reasons"
+        if not file_path.resolve().is_relative_to(self.workspace_root):
+            return f"Error: '{filepath}' is outside the workspace and can't be edited"
+        if not file_path.exists():
+            return f"Error: File '{filepath}' does not exist"
+        if file_path.is_dir():
+            return f"Error: '{filepath}' is a directory, not a file"
+        return None
+
+    def edit_file(
+        self,
+        filepath: str,
+        edits: Optional[List[Dict]] = None,
+        patch: Optional[str] = None,
+    ) -> str:
+        """Apply search/replace edits or a unified diff and write the file atomically"""
+        error = self._check_editable(filepath)
+        if error:
+            return error
+        if not edits and not patch:
+            return "Error: Pass either edits or a patch"
         try:
             file_path = Path(filepath)
-            
-            # Check if file should be ignored
-            if self._should_ignore_file(file_path.name):
-                return (
-                    f"Error: Access to '{filepath}' is restricted for security reasons"
-                )
+            old_text, encoding = read_for_edit(file_path)
+            if edits:
+                new_text = apply_search_replace(old_text, edits)
+            else:
+                new_text = apply_unified_diff(old_text, patch)
+            summary = write_verified(file_path, old_text, new_text, encoding)
+            self.tool_cache.invalidate(filepath)
+            self.search_index.reindex(file_path)
+            return f"Edited '{filepath}': {summary}"
+        except ValueError as e:
+            return f"Error: {str(e)}"
+        except Exception as e:
+            return f"Error editing file: {str(e)}"
 
-            if not file_path.exists():
-                return f"Error: File '{filepath}' does not exist"
+    def rewrite_file(
+        self,
+        filepath: str,
+        instructions: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> str:
+        """
+        Have the model rewrite the whole file. With OpenAI the current content
+        is passed as a predicted output, so unchanged spans are accepted
+        without being generated token by token.
+        Raises OperationCancelled if cancel_token is cancelled meanwhile.
+        """
+        error = self._check_editable(filepath)
+        if error:
+            return error
+        try:
+            file_path = Path(filepath)
+            old_text, encoding = read_for_edit(file_path)
+            messages = [
+                {
+                    "role": "user",
+                    "content": REWRITE_PROMPT.format(
+                        instructions=instructions, content=old_text
+                    ),
+                }
+            ]
+            max_tokens = MAX_OUTPUT_TOKENS.get(self.model, 4096)
+            usage = self.token_counter.usage
+            output_before = usage.output_tokens
+            started = time.monotonic()
 
-            if file_path.is_dir():
-                return f"Error: '{filepath}' is a directory, not a file"
+            # The new content goes to the file, not to the user
+            output_sink, self.output_sink = self.output_sink, None
+            try:
+                if self.message_format == "openai":
+                    options = {"tools": None}
+                    if self.provider == "openai":
+                        options["prediction"] = {"type": "content", "content": old_text}
+                    response = self._stream_openai_response(
+                        messages, max_tokens, cancel_token, options
+                    )
+                    new_text = response["content"]
+                    truncated = response["finish_reason"] == "length"
+                else:
+                    response = self._stream_anthropic_response(
+                        messages,
+                        "",
+                        max_tokens,
+                        cancel_token,
+                        {"tools": None, "system": None},
+                    )
+                    new_text = "".join(
+                        b["text"] for b in response["blocks"] if b["type"] == "text"
+                    )
+                    truncated = response["stop_reason"] == "max_tokens"
+            finally:
+                self.output_sink = output_sink
 
-            content = file_path.read_text(encoding="utf-8")
+            if truncated:
+                return (
+                    f"Error: '{filepath}' is too long to rewrite, use edit_file instead"
+                )
+            fenced = re.match(r"^```[\w-]*\n(.*)\n```\s*$", new_text, re.DOTALL)
+            if fenced:
+                new_text = fenced.group(1)
+            if old_text.endswith("\n") and not new_text.endswith("\n"):
+                new_text += "\n"
 
-            return f"Contents of '{filepath}':\n```\n{content}\n```"
+            summary = write_verified(file_path, old_text, new_text, encoding)
+            self.tool_cache.invalidate(filepath)
+            self.search_index.reindex(file_path)
+            result = (
+                f"Rewrote '{filepath}': {summary}, "
+                f"{usage.output_tokens - output_before} output tokens "
+                f"in {time.monotonic() - started:.1f}s"
+            )
+            details = getattr(response.get("usage"), "completion_tokens_details", None)
+            if details and details.accepted_prediction_tokens is not None:
+                result += (
+                    f" ({details.accepted_prediction_tokens} predicted tokens "
+                    f"accepted, {details.rejected_prediction_tokens} rejected)"
+                )
+            return result
+        except OperationCancelled:
+            raise
+        except ValueError as e:
+            return f"Error: {str(e)}"
         except Exception as e:
-            return f"Error reading file: {str(e)}"
+            return f"Error rewriting file: {str(e)}"
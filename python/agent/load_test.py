@@ -0,0 +1,226 @@
+"""
+Soak/load test for the agent loop against a local mock provider.
+
+    python agent/load_test.py --max-concurrency 8 --stage-seconds 30
+
+Concurrency ramps up in stages (1, 2, 4, ... max). After every stage the
+retained memory (tracemalloc) and RSS are compared with the baseline to
+flag memory that grows with the number of finished sessions.
+"""
+
+import argparse
+import gc
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletionChunk
+
+from agent_basic import run_turn
+from llm import LLMInterface
+from scheduler import FairScheduler
+
+# Retained memory per finished session above this (in bytes) is reported as a leak
+LEAK_THRESHOLD = 4096
+
+USER_PROMPTS = ["What files are here?", "Summarize what you found."]
+
+
+def _chunk(delta: dict, finish_reason=None, usage=None) -> ChatCompletionChunk:
+    data = {
+        "id": "mock",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        data["choices"] = []
+        data["usage"] = usage
+    return ChatCompletionChunk.model_validate(data)
+
+
+class MockStream:
+    def __init__(self, chunks, first_token_latency: float, chunk_latency: float):
+        self._chunks = chunks
+        self._first_token_latency = first_token_latency
+        self._chunk_latency = chunk_latency
+        self._closed = False
+
+    def __iter__(self):
+        time.sleep(self._first_token_latency)
+        for chunk in self._chunks:
+            if self._closed:
+                return
+            time.sleep(self._chunk_latency)
+            yield chunk
+
+    def close(self):
+        self._closed = True
+
+
+class MockOpenAIClient:
+    """
+    Stands in for the OpenAI client: answers a user message with a list_files
+    tool call and a tool result with a streamed text answer
+    """
+
+    def __init__(self, first_token_latency: float = 0.05, chunk_latency: float = 0.002):
+        self.first_token_latency = first_token_latency
+        self.chunk_latency = chunk_latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._call_count = 0
+        self._lock = threading.Lock()
+
+    def _create(self, **request):
+        with self._lock:
+            self._call_count += 1
+            call_id = f"call_{self._call_count}"
+
+        if request["messages"][-1]["role"] == "user":
+            tool_call = {
+                "index": 0,
+                "id": call_id,
+                "type": "function",
+                "function": {"name": "list_files", "arguments": '{"path": "."}'},
+            }
+            chunks = [_chunk({"tool_calls": [tool_call]}, "tool_calls")]
+        else:
+            words = [f"word{i} " for i in range(100)]
+            chunks = [_chunk({"content": w}) for w in words]
+            chunks.append(_chunk({}, "stop"))
+
+        usage = {"prompt_tokens": 500, "completion_tokens": 100, "total_tokens": 600}
+        chunks.append(_chunk({}, usage=usage))
+        return MockStream(chunks, self.first_token_latency, self.chunk_latency)
+
+
+def _rss_bytes() -> int:
+    """Current RSS from /proc when available, peak RSS otherwise"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_session(
+    client: MockOpenAIClient, scheduler: FairScheduler = None, tenant: str = None
+) -> int:
+    """Run one simulated agent session and return the number of turns"""
+    llm = LLMInterface("openai", client=client)
+    if scheduler:
+        llm = scheduler.session(llm, tenant)
+    messages = []
+    for prompt in USER_PROMPTS:
+        messages.append({"role": "user", "content": prompt})
+        run_turn(llm, messages)
+    return len(USER_PROMPTS)
+
+
+def run_stage(
+    client: MockOpenAIClient,
+    concurrency: int,
+    seconds: float,
+    scheduler: FairScheduler = None,
+):
+    """Run sessions on `concurrency` threads for `seconds` and return the totals"""
+    deadline = time.monotonic() + seconds
+    totals = {"sessions": 0, "turns": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def worker(tenant):
+        while time.monotonic() < deadline:
+            try:
+                turns = run_session(client, scheduler, tenant)
+            except Exception:
+                with lock:
+                    totals["errors"] += 1
+                continue
+            with lock:
+                totals["sessions"] += 1
+                totals["turns"] += turns
+
+    # Sessions are spread round-robin over the scheduler's tenants
+    tenants = list(scheduler.tenants) if scheduler else [None]
+    threads = [
+        threading.Thread(target=worker, args=(tenants[i % len(tenants)],))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the agent loop")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--stage-seconds", type=float, default=10)
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--tenants",
+        type=int,
+        default=0,
+        help="share --provider-concurrency slots between this many tenants",
+    )
+    parser.add_argument("--provider-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    client = MockOpenAIClient(first_token_latency=args.first_token_latency)
+    scheduler = None
+    if args.tenants:
+        scheduler = FairScheduler(max_concurrency=args.provider_concurrency)
+        for i in range(args.tenants):
+            scheduler.add_tenant(f"tenant{i}")
+
+    # Warm up imports and caches before taking the baseline
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run_session(client)
+    tracemalloc.start()
+    gc.collect()
+    baseline = tracemalloc.take_snapshot()
+    baseline_traced = tracemalloc.get_traced_memory()[0]
+    baseline_rss = _rss_bytes()
+    total_sessions = 0
+
+    print(f"{'conc':>5} {'sessions':>9} {'turns/s':>8} {'retained':>10} {'rss':>8}")
+    concurrency = 1
+    while concurrency <= args.max_concurrency:
+        started = time.monotonic()
+        # Tool call logging from every session would drown the report
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            totals = run_stage(client, concurrency, args.stage_seconds, scheduler)
+        elapsed = time.monotonic() - started
+        total_sessions += totals["sessions"]
+
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline_traced
+        rss = _rss_bytes() - baseline_rss
+        print(
+            f"{concurrency:>5} {totals['sessions']:>9} "
+            f"{totals['turns'] / elapsed:>8.1f} "
+            f"{retained / 1024:>8.0f}KB {rss / 1024 / 1024:>6.1f}MB"
+            + (f"  ({totals['errors']} errors)" if totals["errors"] else "")
+        )
+        concurrency *= 2
+
+    if scheduler:
+        print(f"\n{scheduler.report()}")
+
+    per_session = retained / max(total_sessions, 1)
+    print(f"\nRetained memory per finished session: {per_session:.0f} bytes")
+    if per_session > LEAK_THRESHOLD:
+        print("⚠️  Memory grows with finished sessions, top allocation sites:")
+        snapshot = tracemalloc.take_snapshot()
+        for stat in snapshot.compare_to(baseline, "lineno")[:10]:
+            print(f"  {stat}")
+
+
+if __name__ == "__main__":
+    main()
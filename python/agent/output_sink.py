@@ -0,0 +1,114 @@
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, TextIO
+
+# Default coalescing window: flush after this many seconds or characters
+DEFAULT_MAX_DELAY = 0.05
+DEFAULT_MAX_CHARS = 4096
+
+
+class OutputSink(ABC):
+    """
+    Collects streamed text deltas and writes them out in bulk, once the
+    oldest buffered delta is max_delay seconds old or max_chars have piled
+    up, instead of one write (and syscall) per token. A timer started with
+    the first buffered delta flushes it even if the stream pauses.
+    Use as a context manager to guarantee the final flush at end of turn.
+    """
+
+    def __init__(
+        self, max_delay: float = DEFAULT_MAX_DELAY, max_chars: int = DEFAULT_MAX_CHARS
+    ):
+        self.max_delay = max_delay
+        self.max_chars = max_chars
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        with self._lock:
+            self._buffer.append(text)
+            self._buffered_chars += len(text)
+            if self._buffered_chars >= self.max_chars:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            self._emit("".join(self._buffer))
+        self._buffer = []
+        self._buffered_chars = 0
+
+    @abstractmethod
+    def _emit(self, text: str) -> None:
+        """Write out one coalesced chunk"""
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TerminalSink(OutputSink):
+    """Writes to stdout"""
+
+    def __init__(self, stream: TextIO = None, **kwargs):
+        super().__init__(**kwargs)
+        self.stream = stream or sys.stdout
+
+    def _emit(self, text: str) -> None:
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class FileSink(OutputSink):
+    """Appends to a file"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _emit(self, text: str) -> None:
+        self.file.write(text)
+        self.file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self.file.close()
+
+
+class SSESink(OutputSink):
+    """
+    Sends Server-Sent Events through a send(bytes) callable, e.g. the write
+    method of an HTTP response; one event per flush instead of per token
+    """
+
+    def __init__(self, send: Callable[[bytes], None], **kwargs):
+        super().__init__(**kwargs)
+        self.send = send
+
+    def _emit(self, text: str) -> None:
+        data = "".join(f"data: {line}\n" for line in text.split("\n"))
+        self.send((data + "\n").encode("utf-8"))
+
+    def close(self) -> None:
+        super().close()
+        self.send(b"event: done\ndata: \n\n")
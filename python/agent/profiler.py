@@ -0,0 +1,231 @@
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Seconds between two samples
+SAMPLE_INTERVAL = 0.005
+
+# Frames kept per sample, counted from the outermost one
+MAX_STACK_DEPTH = 128
+
+# Samples taken inside the provider phase are attributed to deserialization
+# or history handling when one of these files is on the stack
+DESERIALIZATION_FILES = (
+    "pydantic",
+    "/openai/_models",
+    "/anthropic/_models",
+    "json/decoder",
+)
+HISTORY_FILES = (
+    "token_counter.py",
+    "conversation.py",
+    "request_layout.py",
+    "json/encoder",
+)
+
+# thread id -> profiler sampling that thread
+_active: Dict[int, "SamplingProfiler"] = {}
+
+_turn_numbers = itertools.count(1)
+
+Frame = Tuple[str, str, int]
+
+
+@contextmanager
+def phase(name: str):
+    """Mark what the current thread is doing; free when it isn't profiled"""
+    ident = threading.get_ident()
+    profiler = _active.get(ident)
+    if profiler is None:
+        yield
+        return
+    previous, profiler.phases[ident] = profiler.phases[ident], name
+    try:
+        yield
+    finally:
+        profiler.phases[ident] = previous
+
+
+def current_profiler() -> Optional["SamplingProfiler"]:
+    """The profiler sampling the current thread, if any"""
+    return _active.get(threading.get_ident())
+
+
+@contextmanager
+def sampled_by(profiler: Optional["SamplingProfiler"], phase_name: str):
+    """
+    Have profiler also sample the current thread, e.g. a helper thread doing
+    work for the profiled one; does nothing if profiler is None
+    """
+    if profiler is None:
+        yield
+        return
+    profiler.add_thread(phase_name)
+    try:
+        yield
+    finally:
+        profiler.remove_thread()
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (and the helper threads added through
+    sampled_by) from a background thread through sys._current_frames, so the
+    profiled code runs without instrumentation. Each sample is filed under
+    the phase its thread was in (see phase()).
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        # thread id -> current phase of the sampled threads
+        self.phases: Dict[int, str] = {}
+        self.samples: Counter = Counter()
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.duration = 0.0
+
+    def start(self) -> None:
+        """Start sampling the calling thread"""
+        self._thread_id = threading.get_ident()
+        self.phases[self._thread_id] = "other"
+        _active[self._thread_id] = self
+        self._started = time.monotonic()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+
+    def add_thread(self, phase_name: str) -> None:
+        """Sample the calling thread too, starting in phase_name"""
+        ident = threading.get_ident()
+        self.phases[ident] = phase_name
+        _active[ident] = self
+
+    def remove_thread(self) -> None:
+        ident = threading.get_ident()
+        self.phases.pop(ident, None)
+        _active.pop(ident, None)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+        for ident in list(self.phases):
+            _active.pop(ident, None)
+        self.duration = time.monotonic() - self._started
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, current in list(self.phases.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack: List[Frame] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                stack = stack[:MAX_STACK_DEPTH]
+                self.samples[(self._classify(stack, current),) + tuple(stack)] += 1
+
+    def _classify(self, stack: List[Frame], current: str) -> str:
+        if current != "provider":
+            return current
+        files = [filename.replace("\\", "/") for _, filename, _ in stack]
+        if any(p in f for f in files for p in DESERIALIZATION_FILES):
+            return "deserialization"
+        if any(p in f for f in files for p in HISTORY_FILES):
+            return "history"
+        return current
+
+    def phase_totals(self) -> Dict[str, float]:
+        """Seconds spent per phase"""
+        totals: Counter = Counter()
+        for key, count in self.samples.items():
+            totals[key[0]] += count * self.interval
+        return dict(totals.most_common())
+
+    def write_collapsed(self, path: Path) -> None:
+        """One "phase;outer;...;inner count" line per distinct stack"""
+        with open(path, "w", encoding="utf-8") as f:
+            for (phase_name, *stack), count in self.samples.items():
+                names = [phase_name] + [
+                    f"{name} ({Path(filename).name}:{line})"
+                    for name, filename, line in stack
+                ]
+                f.write(";".join(n.replace(";", ",") for n in names) + f" {count}\n")
+
+    def write_speedscope(self, path: Path, name: str) -> None:
+        """A sampled profile for https://www.speedscope.app, phases as root frames"""
+        frames: List[Dict] = []
+        index: Dict[Tuple, int] = {}
+
+        def frame_index(frame: Tuple) -> int:
+            if frame not in index:
+                index[frame] = len(frames)
+                if len(frame) == 1:
+                    frames.append({"name": f"[{frame[0]}]"})
+                else:
+                    frames.append(
+                        {"name": frame[0], "file": frame[1], "line": frame[2]}
+                    )
+            return index[frame]
+
+        samples, weights = [], []
+        for (phase_name, *stack), count in self.samples.items():
+            samples.append(
+                [frame_index((phase_name,))] + [frame_index(f) for f in stack]
+            )
+            weights.append(count * self.interval)
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+            "name": name,
+            "exporter": "agent profiler",
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profile, f)
+
+
+@contextmanager
+def profile_turn(profile_dir: Optional[str]):
+    """
+    Profile the enclosed agent turn and write <name>.speedscope.json and
+    <name>.collapsed.txt to profile_dir; does nothing if it is None
+    """
+    if not profile_dir:
+        yield
+        return
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        directory = Path(profile_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-turn{next(_turn_numbers)}"
+        profiler.write_speedscope(directory / f"{name}.speedscope.json", name)
+        profiler.write_collapsed(directory / f"{name}.collapsed.txt")
+        totals = ", ".join(f"{p} {s:.2f}s" for p, s in profiler.phase_totals().items())
+        print(
+            f"\n📈 Profiled {profiler.duration:.2f}s ({totals}) -> {directory / name}.*"
+        )
@@ -0,0 +1,33 @@
+"""
+Deterministic request layout, so consecutive requests of a conversation
+share a byte-identical prefix and hit OpenAI's automatic prompt caching.
+test_request_layout.py checks that the prefix holds across turns.
+"""
+
+import json
+from typing import Any, Dict, List
+
+
+def canonicalize(value: Any) -> Any:
+    """Copy of value with the keys of every dict in sorted order"""
+    if isinstance(value, dict):
+        return {key: canonicalize(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [canonicalize(item) for item in value]
+    return value
+
+
+def serialize_prompt(tools: List[Dict], messages: List[Dict]) -> str:
+    """The prompt as the provider lays it out: tools first, then the history"""
+    parts = [json.dumps(tools, ensure_ascii=False)]
+    parts += [json.dumps(msg, ensure_ascii=False, default=str) for msg in messages]
+    return "\n".join(parts)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
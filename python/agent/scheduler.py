@@ -0,0 +1,334 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from cancellation import CancellationToken, OperationCancelled
+from llm import LLMInterface
+
+# Length of the window the per-tenant rate budgets apply to (seconds)
+QUOTA_WINDOW = 60.0
+
+# Queue waits kept per tenant for the percentiles
+MAX_WAIT_SAMPLES = 1000
+
+# Rough size of a token, for costs estimated from file sizes
+BYTES_PER_TOKEN = 4
+
+
+@dataclass
+class Tenant:
+    name: str
+    weight: float = 1.0
+    # Completions of this tenant running at the same time
+    max_in_flight: int = 2
+    tokens_per_minute: Optional[int] = None
+    requests_per_minute: Optional[int] = None
+    in_flight: int = 0
+    # Finish tag of the tenant's last queued request (weighted fair queuing)
+    last_tag: float = 0.0
+    # [admitted_at, tokens] of the requests within the quota window
+    window: Deque[List] = field(default_factory=deque)
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=MAX_WAIT_SAMPLES))
+
+
+@dataclass
+class _Ticket:
+    tenant: Tenant
+    cost: int
+    tag: float
+    seq: int
+    enqueued_at: float
+    window_entry: Optional[List] = None
+    # Tokens actually used, set by the caller before release
+    tokens: Optional[int] = None
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class FairScheduler:
+    """
+    Admits completions of many agent sessions to a shared provider quota.
+    Waiting requests are served by weighted fair queuing on their estimated
+    token cost, so a tenant with heavy requests gets its weighted share of
+    the capacity but can't starve the others. Each tenant also has a cap on
+    concurrent completions and optional per-minute token/request budgets.
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        self.max_concurrency = max_concurrency
+        self.tenants: Dict[str, Tenant] = {}
+        self._cond = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def add_tenant(self, name: str, **settings) -> Tenant:
+        with self._cond:
+            self.tenants[name] = Tenant(name=name, **settings)
+            return self.tenants[name]
+
+    def session(self, llm: LLMInterface, tenant: str) -> "ScheduledLLM":
+        """Wrap llm so its completions go through this scheduler"""
+        if tenant not in self.tenants:
+            raise KeyError(f"Unknown tenant: {tenant}")
+        return ScheduledLLM(self, llm, tenant)
+
+    def _prune_window(self, tenant: Tenant, now: float) -> None:
+        while tenant.window and now - tenant.window[0][0] >= QUOTA_WINDOW:
+            tenant.window.popleft()
+
+    def _within_quota(self, tenant: Tenant, cost: int, now: float) -> bool:
+        self._prune_window(tenant, now)
+        if not tenant.window:
+            # Always let one request through, even if it exceeds the budget
+            return True
+        if (
+            tenant.requests_per_minute
+            and len(tenant.window) >= tenant.requests_per_minute
+        ):
+            return False
+        used = sum(tokens for _, tokens in tenant.window)
+        return not tenant.tokens_per_minute or used + cost <= tenant.tokens_per_minute
+
+    def _next(self, now: float) -> Optional[_Ticket]:
+        """Eligible waiting request with the smallest finish tag"""
+        if self._in_flight >= self.max_concurrency:
+            return None
+        eligible = [
+            t
+            for t in self._waiting
+            if t.tenant.in_flight < t.tenant.max_in_flight
+            and self._within_quota(t.tenant, t.cost, now)
+        ]
+        return min(eligible, key=lambda t: (t.tag, t.seq), default=None)
+
+    def _retry_in(self, now: float) -> float:
+        """Seconds until the oldest quota window entry expires"""
+        expiries = [
+            t.tenant.window[0][0] + QUOTA_WINDOW - now
+            for t in self._waiting
+            if t.tenant.window
+        ]
+        return max(min(expiries, default=1.0), 0.01)
+
+    def acquire(
+        self,
+        tenant_name: str,
+        cost: int,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> _Ticket:
+        """Wait until the tenant may start a completion of about cost tokens"""
+
+        def wake():
+            with self._cond:
+                self._cond.notify_all()
+
+        with self._cond:
+            tenant = self.tenants[tenant_name]
+            now = time.monotonic()
+            start = max(self._virtual_time, tenant.last_tag)
+            tenant.last_tag = start + max(cost, 1) / tenant.weight
+            ticket = _Ticket(tenant, cost, tenant.last_tag, next(self._seq), now)
+            self._waiting.append(ticket)
+            if cancel_token:
+                cancel_token.on_cancel(wake)
+            try:
+                while True:
+                    if cancel_token and cancel_token.cancelled:
+                        raise OperationCancelled()
+                    now = time.monotonic()
+                    if self._next(now) is ticket:
+                        break
+                    self._cond.wait(self._retry_in(now))
+            finally:
+                self._waiting.remove(ticket)
+                if cancel_token:
+                    cancel_token.remove_callback(wake)
+                # Someone else may be eligible now
+                self._cond.notify_all()
+
+            tenant.in_flight += 1
+            self._in_flight += 1
+            self._virtual_time = ticket.tag
+            ticket.window_entry = [now, cost]
+            tenant.window.append(ticket.window_entry)
+            tenant.waits.append(now - ticket.enqueued_at)
+            return ticket
+
+    def release(self, ticket: _Ticket, tokens: Optional[int] = None) -> None:
+        """Finish a completion; tokens replaces the estimate in the budget"""
+        with self._cond:
+            ticket.tenant.in_flight -= 1
+            self._in_flight -= 1
+            if tokens is not None:
+                ticket.window_entry[1] = tokens
+            self._cond.notify_all()
+
+    @contextmanager
+    def turn(
+        self,
+        tenant_name: str,
+        cost: int,
+        cancel_token: Optional[CancellationToken] = None,
+    ):
+        """Hold a slot for one completion; set ticket.tokens to the actual usage"""
+        ticket = self.acquire(tenant_name, cost, cancel_token)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, ticket.tokens)
+
+    def wait_stats(self) -> Dict[str, Tuple[int, float, float, float]]:
+        """Per tenant: (samples, p50, p95, max) queue wait in seconds"""
+        stats = {}
+        with self._cond:
+            for name, tenant in self.tenants.items():
+                waits = list(tenant.waits)
+                if waits:
+                    stats[name] = (
+                        len(waits),
+                        _percentile(waits, 0.5),
+                        _percentile(waits, 0.95),
+                        max(waits),
+                    )
+        return stats
+
+    def report(self) -> str:
+        lines = []
+        for name, (count, p50, p95, worst) in self.wait_stats().items():
+            lines.append(
+                f"{name}: {count} requests, queue wait p50 {p50 * 1000:.0f}ms, "
+                f"p95 {p95 * 1000:.0f}ms, max {worst * 1000:.0f}ms"
+            )
+        return "\n".join(lines)
+
+
+class ScheduledLLM:
+    """
+    LLMInterface of one tenant whose provider requests wait for the scheduler:
+    completions, structured completions, best-of-n sampling, rewrite_file
+    and sub-agents
+    """
+
+    def __init__(self, scheduler: FairScheduler, llm: LLMInterface, tenant: str):
+        self.scheduler = scheduler
+        self.llm = llm
+        self.tenant = tenant
+        # The tool handler is bound to llm, route it through this wrapper
+        llm.tool_registry.register(
+            "rewrite_file",
+            lambda args, cancel_token: self.rewrite_file(
+                args.get("filepath", ""), args.get("instructions", ""), cancel_token
+            ),
+            cancellable=True,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    @property
+    def output_sink(self):
+        return self.llm.output_sink
+
+    @output_sink.setter
+    def output_sink(self, sink):
+        self.llm.output_sink = sink
+
+    def _scheduled(self, cost: int, cancel_token: Optional[CancellationToken], call):
+        """Run call in a scheduler turn and charge it the tokens it used"""
+        usage = self.llm.token_counter.usage
+        used_before = usage.input_tokens + usage.output_tokens
+        with self.scheduler.turn(self.tenant, cost, cancel_token) as ticket:
+            try:
+                return call()
+            finally:
+                ticket.tokens = usage.input_tokens + usage.output_tokens - used_before
+
+    def create_completion(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
+    ):
+        return self._scheduled(
+            self.llm._estimate_prompt_tokens(messages, system_prompt),
+            cancel_token,
+            lambda: self.llm.create_completion(
+                messages, system_prompt, task_type, cancel_token
+            ),
+        )
+
+    def create_structured_completion(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        schema,
+        name: str = "response",
+        cancel_token: Optional[CancellationToken] = None,
+    ):
+        return self._scheduled(
+            self.llm._estimate_prompt_tokens(messages, system_prompt),
+            cancel_token,
+            lambda: self.llm.create_structured_completion(
+                messages, system_prompt, schema, name, cancel_token
+            ),
+        )
+
+    def create_completions_n(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        n: int = 3,
+        scorer=None,
+        accept_score: Optional[float] = None,
+        task_type: str = "answer",
+        cancel_token: Optional[CancellationToken] = None,
+    ):
+        return self._scheduled(
+            self.llm._estimate_prompt_tokens(messages, system_prompt),
+            cancel_token,
+            lambda: self.llm.create_completions_n(
+                messages,
+                system_prompt,
+                n,
+                scorer,
+                accept_score,
+                task_type,
+                cancel_token,
+            ),
+        )
+
+    def rewrite_file(
+        self,
+        filepath: str,
+        instructions: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> str:
+        # Refused files are neither queued nor read
+        error = self.llm._check_editable(filepath)
+        if error:
+            return error
+        try:
+            # The file goes in as the prompt (and prediction) and comes back out
+            cost = 2 * (os.path.getsize(filepath) // BYTES_PER_TOKEN)
+        except OSError:
+            cost = 0
+        return self._scheduled(
+            cost,
+            cancel_token,
+            lambda: self.llm.rewrite_file(filepath, instructions, cancel_token),
+        )
+
+    def spawn(self) -> "ScheduledLLM":
+        """Sub-agents run as the same tenant"""
+        return ScheduledLLM(self.scheduler, self.llm.spawn(), self.tenant)
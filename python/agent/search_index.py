@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+
+# Directories that are never indexed
+SKIP_DIRS = {".git", ".venv", "node_modules", "__pycache__"}
+
+# Files larger than this (in bytes) are not indexed
+MAX_INDEX_FILE_SIZE = 1024 * 1024
+
+# Maximum number of matching lines returned by a single search
+MAX_SEARCH_RESULTS = 50
+
+# Seconds a search relies on the last walk of the workspace for changed files
+REFRESH_INTERVAL = 5.0
+
+# Resolved root -> the index shared by every interface working in it
+_shared: Dict[Path, "WorkspaceIndex"] = {}
+_shared_lock = threading.Lock()
+
+
+def _trigrams(text: str) -> Set[str]:
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def is_binary(path: Path) -> bool:
+    with path.open("rb") as f:
+        return b"\0" in f.read(1024)
+
+
+def shared_index(root: Path, should_ignore: Callable[[str], bool]) -> "WorkspaceIndex":
+    """
+    The index of root shared within the process, built in the background
+    from the first call on; the first caller's ignore rules apply
+    """
+    key = Path(root).resolve()
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = WorkspaceIndex(root, should_ignore)
+            _shared[key].start()
+        return _shared[key]
+
+
+class WorkspaceIndex:
+    """
+    Trigram index over the text files of a workspace, kept up to date by mtime.
+    Built by start() in the background, or else on the first search; searches
+    wait for the build and walk the workspace for changes at most every
+    REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, root: Path, should_ignore: Callable[[str], bool]):
+        self.root = Path(root)
+        self.should_ignore = should_ignore
+        # trigram -> files containing it
+        self._postings: Dict[str, Set[Path]] = {}
+        # file -> (mtime, trigrams) of the indexed version
+        self._files: Dict[Path, Tuple[float, Set[str]]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshed_at = None
+
+    def start(self) -> None:
+        """Build the index in a background thread"""
+        threading.Thread(target=self.ensure_fresh, daemon=True).start()
+
+    def ensure_fresh(self) -> None:
+        """
+        Build the index, or refresh it if the last walk is too old; waits
+        for a build or refresh already running
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            if (
+                self._refreshed_at is None
+                or now - self._refreshed_at >= REFRESH_INTERVAL
+            ):
+                self.refresh()
+                self._refreshed_at = time.monotonic()
+
+    def iter_files(self):
+        """Yield indexable files, honoring the ignore patterns"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [
+                d for d in dirnames if d not in SKIP_DIRS and not self.should_ignore(d)
+            ]
+            for filename in filenames:
+                if not self.should_ignore(filename):
+                    yield Path(dirpath) / filename
+
+    def refresh(self) -> None:
+        """Reindex new and modified files and drop deleted ones"""
+        seen = set()
+        for path in self.iter_files():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            seen.add(path)
+            self._index_file(path, stat)
+
+        for path in set(self._files) - seen:
+            self._update(path, None, set())
+
+    def reindex(self, path: Path) -> None:
+        """Pick up a change to one file right away, e.g. after an edit"""
+        try:
+            relative = Path(path).resolve().relative_to(self.root.resolve())
+        except ValueError:
+            return
+        path = self.root / relative
+        try:
+            stat = path.stat()
+        except OSError:
+            self._update(path, None, set())
+            return
+        self._index_file(path, stat)
+
+    def _index_file(self, path: Path, stat: os.stat_result) -> None:
+        indexed = self._files.get(path)
+        if indexed and indexed[0] == stat.st_mtime:
+            return
+        if stat.st_size > MAX_INDEX_FILE_SIZE:
+            return
+        try:
+            if is_binary(path):
+                return
+            text = path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return
+        self._update(path, stat.st_mtime, _trigrams(text))
+
+    def _update(self, path: Path, mtime, trigrams: Set[str]) -> None:
+        with self._lock:
+            _, old_trigrams = self._files.pop(path, (None, set()))
+            for trigram in old_trigrams - trigrams:
+                files = self._postings.get(trigram)
+                if files:
+                    files.discard(path)
+                    if not files:
+                        del self._postings[trigram]
+            if mtime is None:
+                return
+            for trigram in trigrams - old_trigrams:
+                self._postings.setdefault(trigram, set()).add(path)
+            self._files[path] = (mtime, trigrams)
+
+    def _candidates(self, query: str, base: Path) -> List[Path]:
+        with self._lock:
+            if len(query) < 3:
+                files = set(self._files)
+            else:
+                postings = [self._postings.get(t, set()) for t in _trigrams(query)]
+                files = set.intersection(*postings) if postings else set()
+        base = base.resolve()
+        return sorted(
+            f for f in files if f.resolve() == base or base in f.resolve().parents
+        )
+
+    def iter_search(
+        self, query: str, path: str = ".", context_lines: int = 2
+    ) -> Iterator[str]:
+        """
+        Yield lines containing query (case-insensitive) with surrounding
+        context, in chunks, one per match
+        """
+        self.ensure_fresh()
+
+        needle = query.lower()
+        match_count = 0
+        for file_path in self._candidates(query, Path(path)):
+            try:
+                lines = file_path.read_text(
+                    encoding="utf-8", errors="replace"
+                ).splitlines()
+            except OSError:
+                continue
+
+            for i, line in enumerate(lines):
+                if needle not in line.lower():
+                    continue
+                start = max(i - context_lines, 0)
+                end = min(i + context_lines + 1, len(lines))
+                block = []
+                for j in range(start, end):
+                    separator = ":" if j == i else "-"
+                    block.append(f"{file_path}{separator}{j + 1}{separator} {lines[j]}")
+                if match_count == 0:
+                    yield f"Matches for '{query}' in '{path}':\n" + "\n".join(block)
+                else:
+                    yield "\n--\n" + "\n".join(block)
+
+                match_count += 1
+                if match_count >= MAX_SEARCH_RESULTS:
+                    break
+            if match_count >= MAX_SEARCH_RESULTS:
+                break
+
+        if not match_count:
+            yield f"No matches for '{query}' in '{path}'"
+        elif match_count >= MAX_SEARCH_RESULTS:
+            yield f"\n\n(Stopped after {MAX_SEARCH_RESULTS} matches)"
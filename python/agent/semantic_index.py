@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from search_index import (
+    MAX_INDEX_FILE_SIZE,
+    REFRESH_INTERVAL,
+    WorkspaceIndex,
+    is_binary,
+)
+
+# Ollama embedding model (ollama pull nomic-embed-text)
+EMBED_MODEL = "nomic-embed-text"
+
+# Lines per embedded chunk
+CHUNK_LINES = 40
+
+# Chunks sent to the embedding endpoint per request
+EMBED_BATCH_SIZE = 32
+
+# Kept across sessions in the user's own cache directory
+DEFAULT_INDEX_DIR = (
+    Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "llm-agent-vectors"
+)
+
+# Resolved root -> the index shared by every interface working in it
+_shared: Dict[Path, "SemanticIndex"] = {}
+_shared_lock = threading.Lock()
+
+
+def _chunk_file(path: Path) -> List[Dict]:
+    lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+    chunks = []
+    for start in range(0, len(lines), CHUNK_LINES):
+        text = "\n".join(lines[start : start + CHUNK_LINES])
+        if text.strip():
+            chunks.append(
+                {
+                    "path": str(path),
+                    "start_line": start + 1,
+                    "end_line": min(start + CHUNK_LINES, len(lines)),
+                    "text": text,
+                }
+            )
+    return chunks
+
+
+def shared_semantic_index(workspace: WorkspaceIndex) -> "SemanticIndex":
+    """The semantic index of the workspace's root shared within the process"""
+    key = workspace.root.resolve()
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = SemanticIndex(workspace)
+        return _shared[key]
+
+
+class SemanticIndex:
+    """
+    Embeddings of workspace file chunks in a memory-mapped float32 matrix.
+    Rows are L2-normalized so a query is a single matrix-vector product.
+    Searches look for changed files at most every REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, workspace: WorkspaceIndex, index_dir: Path = None):
+        import ollama
+
+        self.workspace = workspace
+        self.client = ollama.Client()
+        root_id = hashlib.sha256(str(workspace.root.resolve()).encode()).hexdigest()
+        self.index_dir = Path(index_dir or DEFAULT_INDEX_DIR) / root_id[:16]
+        # Chunk paths and embeddings are only readable by this user
+        self.index_dir.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.index_dir.mkdir(mode=0o700, exist_ok=True)
+        self._meta_path = self.index_dir / "meta.json"
+        self._vectors_path = self.index_dir / "vectors.f32"
+        self._lock = threading.Lock()
+        self._updated_at = None
+
+        # chunks[i] describes row i of the matrix; None marks a stale row
+        self.chunks: List = []
+        # file -> mtime of the embedded version
+        self.files: Dict[str, float] = {}
+        self.dim = 0
+        self.vectors = None
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            self.chunks = meta["chunks"]
+            self.files = meta["files"]
+            self.dim = meta["dim"]
+            if self.dim:
+                self.vectors = np.memmap(
+                    self._vectors_path, dtype=np.float32, mode="r+"
+                ).reshape(-1, self.dim)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        rows = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            response = self.client.embed(
+                model=EMBED_MODEL, input=texts[i : i + EMBED_BATCH_SIZE]
+            )
+            rows.extend(response["embeddings"])
+        matrix = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _append_rows(self, matrix: np.ndarray) -> None:
+        """Grow the memory-mapped file and write new rows at the end"""
+        old_rows = 0 if self.vectors is None else self.vectors.shape[0]
+        self.dim = matrix.shape[1]
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(self._vectors_path, "ab" if old_rows else "wb"):
+            pass
+        total_rows = old_rows + matrix.shape[0]
+        self.vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(total_rows, self.dim),
+        )
+        self.vectors[old_rows:] = matrix
+        self.vectors.flush()
+
+    def _compact(self) -> None:
+        """Drop stale rows once they make up most of the matrix"""
+        keep = [i for i, chunk in enumerate(self.chunks) if chunk is not None]
+        if len(keep) * 2 >= len(self.chunks):
+            return
+        live = np.array(self.vectors[keep]) if keep else None
+        self.chunks = [self.chunks[i] for i in keep]
+        del self.vectors
+        self.vectors = None
+        self._vectors_path.unlink()
+        if live is not None:
+            self._append_rows(live)
+
+    def update(self) -> None:
+        """Embed chunks of new and modified files and drop those of deleted files"""
+        current = {}
+        for path in self.workspace.iter_files():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if stat.st_size <= MAX_INDEX_FILE_SIZE:
+                current[str(path)] = stat.st_mtime
+
+        changed = {p for p, mtime in current.items() if self.files.get(p) != mtime}
+        removed = set(self.files) - set(current)
+        if not changed and not removed:
+            return
+
+        # Stale rows stay in the matrix but are never returned
+        for i, chunk in enumerate(self.chunks):
+            if chunk is not None and chunk["path"] in changed | removed:
+                self.chunks[i] = None
+        for path in removed:
+            del self.files[path]
+
+        new_chunks = []
+        chunked = []
+        for path in sorted(changed):
+            try:
+                if not is_binary(Path(path)):
+                    new_chunks.extend(_chunk_file(Path(path)))
+            except OSError:
+                continue
+            chunked.append(path)
+
+        if new_chunks:
+            self._append_rows(self._embed([c["text"] for c in new_chunks]))
+            for chunk in new_chunks:
+                del chunk["text"]
+            self.chunks.extend(new_chunks)
+        # Only now, so files whose embedding failed are tried again next time
+        for path in chunked:
+            self.files[path] = current[path]
+        self._compact()
+
+        self._meta_path.write_text(
+            json.dumps({"chunks": self.chunks, "files": self.files, "dim": self.dim})
+        )
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """Return the top_k chunks most similar to the query"""
+        with self._lock:
+            now = time.monotonic()
+            if self._updated_at is None or now - self._updated_at >= REFRESH_INTERVAL:
+                self.update()
+                self._updated_at = time.monotonic()
+            if self.vectors is None or not self.chunks:
+                return []
+
+            query_vector = self._embed([query])[0]
+            scores = self.vectors @ query_vector
+            # Stale rows can never win
+            stale = np.fromiter(
+                (chunk is None for chunk in self.chunks), dtype=bool, count=len(scores)
+            )
+            scores[stale] = -np.inf
+
+            top_k = min(top_k, int((~stale).sum()))
+            if top_k <= 0:
+                return []
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [dict(self.chunks[i], score=float(scores[i])) for i in best]
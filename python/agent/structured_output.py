@@ -0,0 +1,247 @@
+import copy
+import json
+import re
+from typing import Any, Callable, Dict, List, Tuple, Type, Union
+
+from pydantic import BaseModel, ValidationError
+
+# (path of the invalid value, e.g. ("items", 0, "name"), error message)
+SchemaError = Tuple[Tuple, str]
+
+_TYPE_CHECKS = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+}
+
+# Compiled validators by schema (or pydantic model)
+_VALIDATORS: Dict[Any, "SchemaValidator"] = {}
+
+
+def _compile(schema: Dict, root: Dict) -> Callable:
+    """Turn a JSON Schema into a check(value, path, errors) function"""
+    if "$ref" in schema:
+        name = schema["$ref"].split("/")[-1]
+        defs = root.get("$defs") or root.get("definitions") or {}
+        resolved = []
+
+        # Resolved on first use, so recursive models don't recurse here
+        def check_ref(value, path, errors):
+            if not resolved:
+                resolved.append(_compile(defs[name], root))
+            resolved[0](value, path, errors)
+
+        return check_ref
+
+    types = schema.get("type")
+    if isinstance(types, str):
+        types = [types]
+    checks = []
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+        checks.append(
+            lambda v, p, e: v in allowed or e.append((p, f"must be one of {allowed}"))
+        )
+    if "const" in schema:
+        const = schema["const"]
+        checks.append(lambda v, p, e: v == const or e.append((p, f"must be {const!r}")))
+
+    for keyword in ("anyOf", "oneOf"):
+        if keyword in schema:
+            options = [_compile(s, root) for s in schema[keyword]]
+
+            def check_any(value, path, errors, options=options):
+                for option in options:
+                    option_errors = []
+                    option(value, path, option_errors)
+                    if not option_errors:
+                        return
+                errors.append((path, "does not match any of the allowed schemas"))
+
+            checks.append(check_any)
+
+    if "properties" in schema or "required" in schema:
+        properties = {
+            name: _compile(s, root) for name, s in schema.get("properties", {}).items()
+        }
+        required = schema.get("required", [])
+        extra_allowed = schema.get("additionalProperties", True) is not False
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append((path + (name,), "is required"))
+            for name, item in value.items():
+                if name in properties:
+                    properties[name](item, path + (name,), errors)
+                elif not extra_allowed:
+                    errors.append((path + (name,), "is not allowed"))
+
+        checks.append(check_object)
+
+    if "items" in schema:
+        check_item = _compile(schema["items"], root)
+
+        def check_array(value, path, errors):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    check_item(item, path + (i,), errors)
+
+        checks.append(check_array)
+
+    for keyword, test, message in (
+        ("minimum", lambda v, x: v >= x, "must be >= {}"),
+        ("maximum", lambda v, x: v <= x, "must be <= {}"),
+        ("minLength", lambda v, x: len(v) >= x, "must be at least {} characters"),
+        ("maxLength", lambda v, x: len(v) <= x, "must be at most {} characters"),
+        ("minItems", lambda v, x: len(v) >= x, "must have at least {} items"),
+        ("maxItems", lambda v, x: len(v) <= x, "must have at most {} items"),
+    ):
+        if keyword in schema:
+            limit = schema[keyword]
+            kind = (str,) if "Length" in keyword else (list,)
+            if keyword in ("minimum", "maximum"):
+                kind = (int, float)
+
+            def check_limit(
+                value, path, errors, limit=limit, test=test, kind=kind, message=message
+            ):
+                if isinstance(value, kind) and not test(value, limit):
+                    errors.append((path, message.format(limit)))
+
+            checks.append(check_limit)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(value, path, errors):
+            if isinstance(value, str) and not pattern.search(value):
+                errors.append((path, f"must match {pattern.pattern!r}"))
+
+        checks.append(check_pattern)
+
+    def check(value, path, errors):
+        if types and not any(_TYPE_CHECKS[t](value) for t in types):
+            errors.append((path, f"must be of type {' or '.join(types)}"))
+            return
+        for c in checks:
+            c(value, path, errors)
+
+    return check
+
+
+class SchemaValidator:
+    """
+    A JSON Schema (or pydantic model) compiled once into nested check
+    functions; get instances through get_validator to reuse them
+    """
+
+    def __init__(self, schema: Union[Dict, Type[BaseModel]]):
+        self.model = None
+        if isinstance(schema, type) and issubclass(schema, BaseModel):
+            self.model = schema
+            schema = schema.model_json_schema()
+        self.schema = schema
+        self._check = _compile(schema, schema)
+
+    def _resolve(self, schema: Dict) -> Dict:
+        while "$ref" in schema:
+            defs = self.schema.get("$defs") or self.schema.get("definitions") or {}
+            schema = defs[schema["$ref"].split("/")[-1]]
+        return schema
+
+    def _drop_nulls(self, value: Any, schema: Dict = None) -> Any:
+        """
+        Drop null optional fields at every depth (strict mode sends them for
+        missing values, see strict_schema)
+        """
+        schema = self._resolve(self.schema if schema is None else schema)
+        for keyword in ("anyOf", "oneOf"):
+            for option in schema.get(keyword, []):
+                option = self._resolve(option)
+                if ("properties" in option and isinstance(value, dict)) or (
+                    "items" in option and isinstance(value, list)
+                ):
+                    return self._drop_nulls(value, option)
+        if isinstance(value, dict) and "properties" in schema:
+            properties = schema["properties"]
+            required = schema.get("required", [])
+            return {
+                k: self._drop_nulls(v, properties[k]) if k in properties else v
+                for k, v in value.items()
+                if v is not None or k in required
+            }
+        if isinstance(value, list) and isinstance(schema.get("items"), dict):
+            return [self._drop_nulls(item, schema["items"]) for item in value]
+        return value
+
+    def errors(self, value: Any) -> List[SchemaError]:
+        value = self._drop_nulls(value)
+        if self.model is not None:
+            try:
+                self.model.model_validate(value)
+            except ValidationError as e:
+                return [(tuple(err["loc"]), err["msg"]) for err in e.errors()]
+            return []
+        errors = []
+        self._check(value, (), errors)
+        return errors
+
+    def parse(self, value: Any) -> Any:
+        """The validated value, as a model instance if a model was given"""
+        value = self._drop_nulls(value)
+        if self.model is not None:
+            return self.model.model_validate(value)
+        return value
+
+
+def get_validator(schema: Union[Dict, Type[BaseModel]]) -> SchemaValidator:
+    key = schema if isinstance(schema, type) else json.dumps(schema, sort_keys=True)
+    if key not in _VALIDATORS:
+        _VALIDATORS[key] = SchemaValidator(schema)
+    return _VALIDATORS[key]
+
+
+def strict_schema(schema: Any) -> Any:
+    """
+    Adapt a schema to OpenAI's strict mode: every object lists all of its
+    properties as required and allows no others, optional ones become nullable
+    """
+    if isinstance(schema, list):
+        return [strict_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    result = {k: strict_schema(v) for k, v in schema.items() if k != "default"}
+    if "properties" in result and isinstance(result["properties"], dict):
+        properties = result["properties"]
+        for name in set(properties) - set(schema.get("required", [])):
+            prop = properties[name]
+            if isinstance(prop.get("type"), str):
+                prop["type"] = [prop["type"], "null"]
+            elif "type" not in prop:
+                properties[name] = {"anyOf": [prop, {"type": "null"}]}
+        result["required"] = list(properties)
+        result["additionalProperties"] = False
+    return result
+
+
+def repair_schema(schema: Dict, fields: List[str]) -> Dict:
+    """Schema of an object holding only the given top-level fields"""
+    properties = schema.get("properties", {})
+    result = {
+        "type": "object",
+        "properties": {f: copy.deepcopy(properties[f]) for f in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+    for key in ("$defs", "definitions"):
+        if key in schema:
+            result[key] = schema[key]
+    return result
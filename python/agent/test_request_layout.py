@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import llm as llm_module
+from llm import LLMInterface
+from load_test import MockOpenAIClient
+from request_layout import common_prefix_length, serialize_prompt
+
+SYSTEM_PROMPT = "You are a helpful agent."
+
+
+def _reordered(value):
+    """Copy of value with the keys of every dict in reverse insertion order"""
+    if isinstance(value, dict):
+        return {key: _reordered(value[key]) for key in reversed(list(value))}
+    if isinstance(value, list):
+        return [_reordered(item) for item in value]
+    return value
+
+
+def _roundtrip(messages):
+    """The history as it comes back from a cassette or a saved conversation"""
+    return [_reordered(json.loads(json.dumps(msg))) for msg in messages]
+
+
+def _run_turns():
+    """Two turns whose second request re-sends the first one's history reordered"""
+    client = MockOpenAIClient(first_token_latency=0, chunk_latency=0)
+    requests = []
+    create = client.chat.completions.create
+
+    def recording_create(**request):
+        requests.append(request)
+        return create(**request)
+
+    client.chat.completions.create = recording_create
+    llm = LLMInterface("openai", client=client)
+
+    messages = [{"role": "user", "content": "What files are here?"}]
+    _, tool_calls = llm.create_completion(messages, SYSTEM_PROMPT)
+    llm.add_assistant_message_with_tools(messages, tool_calls)
+    for tool_call in tool_calls:
+        llm.add_tool_response(messages, tool_call, "README.md\nagent/")
+
+    messages = _roundtrip(messages)
+    llm.create_completion(messages, SYSTEM_PROMPT)
+    return requests
+
+
+def _assert_prefix_stable(requests):
+    assert len(requests) == 2
+    first, second = requests
+    assert json.dumps(first["tools"]) == json.dumps(second["tools"])
+    previous = serialize_prompt(first["tools"], first["messages"])
+    current = serialize_prompt(second["tools"], second["messages"])
+    shared = common_prefix_length(previous, current)
+    assert shared == len(
+        previous
+    ), f"prefix changed at char {shared}: {previous[shared:shared + 60]!r}"
+
+
+def test_prefix_stable_across_turns():
+    _assert_prefix_stable(_run_turns())
+
+
+def test_reordered_history_changes_prefix_without_canonicalize(monkeypatch):
+    monkeypatch.setattr(llm_module, "canonicalize", lambda value: value)
+    with pytest.raises(AssertionError, match="prefix changed"):
+        _assert_prefix_stable(_run_turns())
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    # Optional: exact BPE token counts for OpenAI models (pip install tiktoken)
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# USD per million (input, output) tokens
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00),
+}
+
+# Tokens each message adds on top of its content (role, separators)
+MESSAGE_OVERHEAD = 4
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _approximate_tokens(text: str) -> int:
+    """Approximate BPE token count: one per punctuation mark, ~4 chars per word piece"""
+    count = 0
+    for piece in _WORD_PATTERN.findall(text):
+        count += (len(piece) + 3) // 4
+    return count
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a conversation has used up its token budget"""
+
+
+@dataclass
+class UsageTotals:
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # Input tokens served from the provider's prompt cache
+    cached_tokens: int = 0
+    cost: float = 0.0
+
+    def add(self, other: "UsageTotals") -> None:
+        """Add the totals of another counter, e.g. of a sub-agent"""
+        self.requests += other.requests
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.cached_tokens += other.cached_tokens
+        self.cost += other.cost
+
+
+class TokenCounter:
+    """Counts prompt tokens locally, memoizing counts per message"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        if tiktoken is not None and model.startswith("gpt"):
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except (KeyError, ValueError):
+                self._encoding = tiktoken.get_encoding("o200k_base")
+        # digest of the serialized message -> token count
+        self._message_counts: Dict[bytes, int] = {}
+        self.usage = UsageTotals()
+        # Cached input tokens of the latest request
+        self.last_cached_tokens = 0
+
+    def count_text(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return _approximate_tokens(text)
+
+    def count_message(self, message: Any) -> int:
+        return self._count_serialized(json.dumps(message, sort_keys=True, default=str))
+
+    def _count_serialized(self, serialized: str) -> int:
+        key = hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).digest()
+        count = self._message_counts.get(key)
+        if count is None:
+            count = self.count_text(serialized) + MESSAGE_OVERHEAD
+            self._message_counts[key] = count
+        return count
+
+    def count_prompt(
+        self,
+        messages: List[Dict],
+        system_prompt: str = "",
+        tools: Optional[List] = None,
+    ) -> int:
+        """Count the tokens of a full request; unchanged messages hit the cache"""
+        total = self.count_text(system_prompt) if system_prompt else 0
+        if tools:
+            total += self.count_message(tools)
+        if hasattr(messages, "encoded_messages"):
+            # Conversation: reuse the encodings cached in its nodes
+            for serialized in messages.encoded_messages():
+                total += self._count_serialized(serialized)
+            return total
+        for msg in messages:
+            total += self.count_message(msg)
+        return total
+
+    def record_usage(self, usage: Any) -> None:
+        """Add the usage reported by an OpenAI or Anthropic response to the totals"""
+        if usage is None:
+            return
+        input_tokens = getattr(usage, "prompt_tokens", None)
+        if input_tokens is None:
+            input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "completion_tokens", None)
+        if output_tokens is None:
+            output_tokens = getattr(usage, "output_tokens", 0) or 0
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None)
+        if cached_tokens is None:
+            cached_tokens = getattr(usage, "cache_read_input_tokens", 0)
+        self.last_cached_tokens = cached_tokens or 0
+
+        input_price, output_price = PRICES.get(self.model, (0.0, 0.0))
+        self.usage.requests += 1
+        self.usage.cached_tokens += self.last_cached_tokens
+        self.usage.input_tokens += input_tokens
+        self.usage.output_tokens += output_tokens
+        self.usage.cost += (
+            input_tokens * input_price + output_tokens * output_price
+        ) / 1_000_000
@@ -0,0 +1,167 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+from search_index import SKIP_DIRS
+
+# Total size of the cached tool results (in characters)
+MAX_CACHE_CHARS = 16 * 1024 * 1024
+
+# Warm-up limits: bytes read (listings included), directories listed, files
+# read and largest file read up front
+WARM_UP_MAX_BYTES = 8 * 1024 * 1024
+WARM_UP_MAX_DIRS = 200
+WARM_UP_MAX_FILES = 1000
+WARM_UP_MAX_FILE_SIZE = 64 * 1024
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    """Changes whenever the file (or the entries of the directory) change"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class ToolResultCache:
+    """
+    Results of file tools keyed by tool, path and args. An entry is only
+    returned while the path's mtime and size are unchanged; least recently
+    used entries go first once MAX_CACHE_CHARS is reached.
+    """
+
+    def __init__(self, max_chars: int = MAX_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def cached(self, tool: str, path: str, compute: Callable[[], str], *args) -> str:
+        """Return the cached result or compute and store it"""
+        return "".join(self.cached_stream(tool, path, lambda: [compute()], *args))
+
+    def cached_stream(
+        self, tool: str, path: str, produce: Callable[[], Iterator[str]], *args
+    ) -> Iterator[str]:
+        """
+        Yield the cached result as one chunk, or the chunks of produce(),
+        storing their concatenation once all of them were consumed
+        """
+        # Keyed by the path as given, results quote it back
+        key = (tool, path) + args
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and stamp is not None and entry[0] == stamp
+            if hit:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        # Yielded outside the lock, the consumer may take its time
+        if hit:
+            yield entry[1]
+            return
+
+        # Stamped before producing, so a change in between is noticed next time
+        parts = []
+        for chunk in produce():
+            parts.append(chunk)
+            yield chunk
+        result = "".join(parts)
+        if stamp is not None and not result.startswith("Error"):
+            self._store(key, stamp, result)
+
+    def _store(self, key: Tuple, stamp: Tuple[int, int], result: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._chars -= len(old[1])
+            self._entries[key] = (stamp, result)
+            self._chars += len(result)
+            while self._chars > self.max_chars and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+
+    def invalidate(self, path: str) -> None:
+        """Drop all results for path"""
+        path = Path(path)
+        with self._lock:
+            for key in [k for k in self._entries if Path(k[1]) == path]:
+                self._chars -= len(self._entries.pop(key)[1])
+
+
+class WorkspaceWarmer:
+    """
+    Lists directories and reads small files breadth-first in a background
+    thread, through the same cached tool functions the model calls, so the
+    first tool calls of a session are served from memory. stop() ends it
+    before the next file system access.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        should_ignore: Callable[[str], bool],
+        list_files: Callable[[str], str],
+        read_file: Callable[[str], str],
+    ):
+        self.root = Path(root)
+        self.should_ignore = should_ignore
+        self.list_files = list_files
+        self.read_file = read_file
+        self.bytes_read = 0
+        self.dirs_listed = 0
+        self.files_read = 0
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        directories = deque([self.root])
+        files = deque()
+        # Listings of all levels first, they are the cheapest and most asked for
+        while directories and not self._stop.is_set():
+            if (
+                self.dirs_listed >= WARM_UP_MAX_DIRS
+                or self.bytes_read >= WARM_UP_MAX_BYTES
+            ):
+                break
+            directory = directories.popleft()
+            self.bytes_read += len(self.list_files(str(directory)))
+            self.dirs_listed += 1
+            try:
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if self.should_ignore(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS:
+                            directories.append(Path(entry.path))
+                    elif entry.stat().st_size <= WARM_UP_MAX_FILE_SIZE:
+                        files.append((Path(entry.path), entry.stat().st_size))
+                except OSError:
+                    continue
+
+        while files and not self._stop.is_set():
+            path, size = files.popleft()
+            if (
+                self.files_read >= WARM_UP_MAX_FILES
+                or self.bytes_read + size > WARM_UP_MAX_BYTES
+            ):
+                break
+            self.read_file(str(path))
+            self.files_read += 1
+            self.bytes_read += size
@@ -0,0 +1,250 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from queue import Empty, Full, Queue
+from typing import Callable, Dict, Iterator, Optional, Union
+
+from cancellation import CancellationToken, OperationCancelled
+from profiler import current_profiler, sampled_by
+
+# Worker processes of the pool shared by all registries
+POOL_WORKERS = 2
+
+# Results larger than this (in bytes) come back from workers through shared memory
+SHARED_MEMORY_THRESHOLD = 256 * 1024
+
+# Chunks a streaming tool may produce ahead of the one being passed on;
+# beyond that it waits, so a slow consumer can't make it pile up output
+MAX_PENDING_CHUNKS = 8
+
+# Seconds between checks for cancellation while waiting for chunks or workers
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _put(queue: Queue, item, stop: threading.Event) -> bool:
+    """Block until item is queued (True) or stop is set (False)"""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _produce(
+    chunks: Iterator[str], queue: Queue, stop: threading.Event, profiler
+) -> None:
+    """Move the chunks of a streaming tool into queue, then _END or the error"""
+    # The tool's work happens here, not in the waiting caller
+    with sampled_by(profiler, "tool"):
+        try:
+            for chunk in chunks:
+                if not _put(queue, chunk, stop):
+                    return
+            end = _END
+        except Exception as e:
+            end = e
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        _put(queue, end, stop)
+
+
+def _collect(
+    chunks: Iterator[str],
+    on_chunk: Optional[Callable[[str], None]],
+    cancel_token: Optional[CancellationToken],
+) -> str:
+    """
+    Join the chunks of a streaming tool, passing each one to on_chunk. The
+    tool runs in its own thread feeding a bounded queue, so it keeps going
+    while on_chunk writes and waits once MAX_PENDING_CHUNKS are queued.
+    """
+    parts = []
+    if on_chunk is None:
+        for chunk in chunks:
+            if cancel_token:
+                cancel_token.raise_if_cancelled("".join(parts))
+            parts.append(chunk)
+        return "".join(parts)
+
+    queue: Queue = Queue(maxsize=MAX_PENDING_CHUNKS)
+    stop = threading.Event()
+    threading.Thread(
+        target=_produce, args=(chunks, queue, stop, current_profiler()), daemon=True
+    ).start()
+    try:
+        while True:
+            if cancel_token:
+                cancel_token.raise_if_cancelled("".join(parts))
+            try:
+                item = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if item is _END:
+                return "".join(parts)
+            if isinstance(item, Exception):
+                raise item
+            parts.append(item)
+            on_chunk(item)
+    finally:
+        stop.set()
+
+
+@dataclass
+class Tool:
+    handler: Callable[[Dict], Union[str, Iterator[str]]]
+    cpu_bound: bool
+    limit: Optional[threading.BoundedSemaphore]
+    cancellable: bool = False
+
+
+def _warm_up() -> None:
+    """No-op run once in every worker so the first real call doesn't pay the startup"""
+
+
+def _run_in_worker(handler: Callable[[Dict], str], args: Dict):
+    """Run a CPU-bound handler in a worker process"""
+    result = handler(args)
+    data = result.encode("utf-8")
+    if len(data) < SHARED_MEMORY_THRESHOLD:
+        return result
+
+    # Large payloads skip the pickle pipe: the parent reads and frees the block
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[: len(data)] = data
+    name = shm.name
+    shm.close()
+    # The parent owns the block from here on, don't let this worker's
+    # resource tracker remove it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return (name, len(data))
+
+
+def _read_shared_result(name: str, size: int) -> str:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size]).decode("utf-8")
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _discard_result(future) -> None:
+    """Free the shared memory of a result nobody waits for anymore"""
+    if not future.cancelled() and future.exception() is None:
+        result = future.result()
+        if isinstance(result, tuple):
+            _read_shared_result(*result)
+
+
+def _shared_pool() -> ProcessPoolExecutor:
+    """
+    The process pool for CPU-bound tools, started with warm workers by the
+    first CPU-bound call
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # The agent runs threads (warm-up, profiler, sinks), don't fork
+            # workers off it where a fork server is available
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else None
+            )
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=context)
+            # Start the workers now rather than on the first tool call
+            warm_ups = [_pool.submit(_warm_up) for _ in range(POOL_WORKERS)]
+            for future in warm_ups:
+                future.result()
+        return _pool
+
+
+class ToolRegistry:
+    """Maps tool names to handlers, running CPU-bound ones in a process pool"""
+
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+
+    def register(
+        self,
+        name: str,
+        handler: Callable[[Dict], Union[str, Iterator[str]]],
+        cpu_bound: bool = False,
+        max_concurrency: Optional[int] = None,
+        cancellable: bool = False,
+    ) -> None:
+        """
+        Register a tool handler taking the tool args dict and returning the result,
+        or an iterator of result chunks to stream it (see execute).
+        CPU-bound handlers must be module-level functions so they can be pickled,
+        and return a string.
+        Cancellable handlers are called as handler(args, cancel_token) so
+        long-running work can stop when the call is cancelled.
+        """
+        limit = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._tools[name] = Tool(handler, cpu_bound, limit, cancellable)
+
+    def execute(
+        self,
+        name: str,
+        args: Dict,
+        cancel_token: Optional[CancellationToken] = None,
+        on_chunk: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Run a tool and return its result.
+        The chunks of a streaming handler are passed to on_chunk as they come
+        (e.g. an output sink's write) and joined into the result.
+        Raises OperationCancelled if cancel_token is cancelled before the tool
+        finishes; inline handlers are only checked before they start, or
+        between chunks if they stream, unless they are cancellable.
+        A CPU-bound handler already running in a worker can't be stopped:
+        the call returns at once and the worker's result is discarded.
+        """
+        tool = self._tools.get(name)
+        if tool is None:
+            return f"Error: Unknown tool '{name}'"
+
+        if tool.limit:
+            tool.limit.acquire()
+        try:
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            if not tool.cpu_bound:
+                if tool.cancellable:
+                    result = tool.handler(args, cancel_token)
+                else:
+                    result = tool.handler(args)
+                if isinstance(result, str):
+                    return result
+                return _collect(result, on_chunk, cancel_token)
+
+            future = _shared_pool().submit(_run_in_worker, tool.handler, args)
+            try:
+                while not wait([future], timeout=POLL_INTERVAL).done:
+                    if cancel_token:
+                        cancel_token.raise_if_cancelled()
+            except OperationCancelled:
+                if not future.cancel():
+                    future.add_done_callback(_discard_result)
+                raise
+            result = future.result()
+            if isinstance(result, tuple):
+                return _read_shared_result(*result)
+            return result
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            return f"Error running tool '{name}': {str(e)}"
+        finally:
+            if tool.limit:
+                tool.limit.release()
@@ -1,4 +1,5 @@
 import os
+import time
 from anthropic import Anthropic
 
 from dotenv import load_dotenv
@@ -11,6 +12,26 @@ SYS_PROMPT = """
 You are a friendly chatbot answering the user's questions.
 """
 
+# Streamed text is written out in bulk, at most every MAX_DELAY seconds,
+# instead of one write and flush per token
+MAX_DELAY = 0.05
+pending = []
+last_write = time.monotonic()
+
+
+def flush():
+    global last_write
+    print("".join(pending), end="", flush=True)
+    pending.clear()
+    last_write = time.monotonic()
+
+
+def write(text):
+    pending.append(text)
+    if time.monotonic() - last_write >= MAX_DELAY:
+        flush()
+
+
 user_msg = "Please write a short poem about LLMs"
 
 with client.messages.stream(
@@ -20,4 +41,5 @@ with client.messages.stream(
     system=SYS_PROMPT,
 ) as stream:
     for text in stream.text_stream:
-        print(text, end="", flush=True)
+        write(text)
+flush()
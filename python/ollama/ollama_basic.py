@@ -1,7 +1,29 @@
+import time
+
 import ollama
 
 client = ollama.Client()
 
+# Streamed text is written out in bulk, at most every MAX_DELAY seconds,
+# instead of one write and flush per token
+MAX_DELAY = 0.05
+pending = []
+last_write = time.monotonic()
+
+
+def flush():
+    global last_write
+    print("".join(pending), end="", flush=True)
+    pending.clear()
+    last_write = time.monotonic()
+
+
+def write(text):
+    pending.append(text)
+    if time.monotonic() - last_write >= MAX_DELAY:
+        flush()
+
+
 stream = client.chat(
     model="llama3.2",
     messages=[{"role": "user", "content": "Please write a poem"}],
@@ -9,4 +31,5 @@ stream = client.chat(
 )
 
 for chunk in stream:
-    print(chunk["message"]["content"], end="", flush=True)
+    write(chunk["message"]["content"])
+flush()
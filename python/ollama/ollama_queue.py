@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import ollama
+
+# Request priorities, lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+# Requests for a resident model may overtake older ones for another model
+# (saving a model swap) until the older request has waited this long (seconds)
+MAX_GROUPING_DELAY = 2.0
+
+
+@dataclass
+class _Request:
+    model: str
+    priority: int
+    seq: int
+    enqueued_at: float
+    granted: asyncio.Future
+
+
+@dataclass
+class QueueStats:
+    waits: Dict[int, List[float]] = field(default_factory=dict)
+    max_depth: int = 0
+    model_swaps: int = 0
+
+    def report(self, depth: int) -> str:
+        lines = [f"depth {depth} (max {self.max_depth}), {self.model_swaps} swaps"]
+        for priority, waits in sorted(self.waits.items()):
+            name = {INTERACTIVE: "interactive", BATCH: "batch"}.get(priority, priority)
+            lines.append(
+                f"{name}: {len(waits)} requests, avg wait "
+                f"{sum(waits) / len(waits):.3f}s, max {max(waits):.3f}s"
+            )
+        return "\n".join(lines)
+
+
+class OllamaQueue:
+    """
+    Client-side admission queue in front of an ollama.AsyncClient.
+    At most num_parallel requests (the server's OLLAMA_NUM_PARALLEL) run at a
+    time, the rest wait in priority order. Requests for a model that is
+    already loaded are started together, so the server batches them across
+    its parallel slots instead of swapping models in between; a model that
+    isn't loaded only starts once the requests for the other models drained.
+    """
+
+    def __init__(
+        self,
+        client: ollama.AsyncClient = None,
+        num_parallel: int = None,
+        max_loaded_models: int = None,
+    ):
+        self.client = client or ollama.AsyncClient()
+        self.num_parallel = num_parallel or int(os.getenv("OLLAMA_NUM_PARALLEL", 4))
+        self.max_loaded_models = max_loaded_models or int(
+            os.getenv("OLLAMA_MAX_LOADED_MODELS", 1)
+        )
+        self.stats = QueueStats()
+        self._pending: List[_Request] = []
+        self._running: Dict[str, int] = {}
+        # Loaded models, least recently used first; None until asked the server
+        self._loaded: Optional[List[str]] = None
+        self._seq = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def report(self) -> str:
+        return self.stats.report(self.depth)
+
+    async def _refresh_loaded(self) -> None:
+        try:
+            response = await self.client.ps()
+            self._loaded = [m["name"] for m in response.get("models", [])]
+        except Exception:
+            self._loaded = []
+
+    def _is_loaded(self, model: str) -> bool:
+        # "llama3.2" and "llama3.2:latest" name the same model
+        return any(m in (model, f"{model}:latest") for m in self._loaded)
+
+    def _pick(self) -> Optional[_Request]:
+        """Next request allowed to start, or None if all have to wait"""
+        top = min(r.priority for r in self._pending)
+        candidates = sorted(
+            (r for r in self._pending if r.priority == top), key=lambda r: r.seq
+        )
+        oldest = candidates[0]
+        waited = time.monotonic() - oldest.enqueued_at
+        request = oldest
+        if waited < MAX_GROUPING_DELAY:
+            request = next((r for r in candidates if self._is_loaded(r.model)), oldest)
+
+        if not self._is_loaded(request.model):
+            others = [m for m, n in self._running.items() if n and m != request.model]
+            if len(others) >= self.max_loaded_models:
+                # Starting it now would unload a model that is still in use
+                return None
+        return request
+
+    def _dispatch(self) -> None:
+        while self._pending and sum(self._running.values()) < self.num_parallel:
+            request = self._pick()
+            if request is None:
+                return
+            self._pending.remove(request)
+            if not self._is_loaded(request.model):
+                self.stats.model_swaps += 1
+                self._loaded.append(request.model)
+                del self._loaded[: -self.max_loaded_models]
+            self._running[request.model] = self._running.get(request.model, 0) + 1
+            wait = time.monotonic() - request.enqueued_at
+            self.stats.waits.setdefault(request.priority, []).append(wait)
+            request.granted.set_result(None)
+
+    async def _acquire(self, model: str, priority: int) -> None:
+        if self._loaded is None:
+            await self._refresh_loaded()
+        request = _Request(
+            model=model,
+            priority=priority,
+            seq=next(self._seq),
+            enqueued_at=time.monotonic(),
+            granted=asyncio.get_running_loop().create_future(),
+        )
+        self._pending.append(request)
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        self._dispatch()
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            if request.granted.done() and not request.granted.cancelled():
+                self._release(model)
+            else:
+                self._pending.remove(request)
+            raise
+
+    def _release(self, model: str) -> None:
+        self._running[model] -= 1
+        self._dispatch()
+
+    async def _hold_slot(self, model: str, stream):
+        """Keep the slot until the stream is consumed or closed"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self._release(model)
+
+    async def chat(self, model: str, messages: List, priority=INTERACTIVE, **kwargs):
+        """Queued client.chat; with stream=True the slot is held until the end"""
+        await self._acquire(model, priority)
+        try:
+            response = await self.client.chat(model=model, messages=messages, **kwargs)
+        except BaseException:
+            self._release(model)
+            raise
+        if not kwargs.get("stream"):
+            self._release(model)
+            return response
+        return self._hold_slot(model, response)
@@ -2,6 +2,8 @@ import ollama
 import random
 import asyncio
 
+from ollama_queue import OllamaQueue
+
 MODEL = "llama3.2"
 
 SYS_PROMPT = """
@@ -43,7 +45,8 @@ def handle_tool_call(tool_call):
 
 
 async def run():
-    client = ollama.AsyncClient()
+    # Requests wait for a free server slot instead of piling up
+    queue = OllamaQueue(ollama.AsyncClient())
 
     user_msg = "What's the weather like in Helsinki?"
 
@@ -52,7 +55,7 @@ async def run():
         {"role": "user", "content": user_msg},
     ]
 
-    response = await client.chat(model=MODEL, messages=messages, tools=tools)
+    response = await queue.chat(MODEL, messages, tools=tools)
     messages.append(response["message"])
 
     if response["message"].get("tool_calls"):
@@ -60,9 +63,7 @@ async def run():
             tool_result = handle_tool_call(tool_call)
             messages.append({"role": "tool", "content": tool_result})
 
-    stream = await client.chat(
-        model=MODEL, messages=messages, tools=tools, stream=True
-    )
+    stream = await queue.chat(MODEL, messages, tools=tools, stream=True)
 
     async for chunk in stream:
         print(chunk["message"]["content"], end="", flush=True)
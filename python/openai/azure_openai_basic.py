@@ -1,4 +1,5 @@
 import os
+import time
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
@@ -22,6 +23,26 @@ SYS_PROMPT = """
 You are a friendly chatbot answering the user's questions.
 """
 
+# Streamed text is written out in bulk, at most every MAX_DELAY seconds,
+# instead of one write and flush per token
+MAX_DELAY = 0.05
+pending = []
+last_write = time.monotonic()
+
+
+def flush():
+    global last_write
+    print("".join(pending), end="", flush=True)
+    pending.clear()
+    last_write = time.monotonic()
+
+
+def write(text):
+    pending.append(text)
+    if time.monotonic() - last_write >= MAX_DELAY:
+        flush()
+
+
 user_msg = "Please write a short poem about LLMs"
 
 messages = [
@@ -37,4 +58,5 @@ stream = llm.chat.completions.create(
 for chunk in stream:
     if len(chunk.choices) > 0 and chunk.choices[0].delta:
         content = chunk.choices[0].delta.content or ""
-        print(content, end="", flush=True)
+        write(content)
+flush()
@@ -1,6 +1,7 @@
 import json
 import os
 import random
+import time
 from typing import List
 from openai import OpenAI
 from openai.types.chat import ChatCompletionToolParam
@@ -56,6 +57,26 @@ tools: List[ChatCompletionToolParam] = [
 ]
 
 
+# Streamed text is written out in bulk, at most every MAX_DELAY seconds,
+# instead of one write and flush per token
+MAX_DELAY = 0.05
+pending = []
+last_write = time.monotonic()
+
+
+def flush():
+    global last_write
+    print("".join(pending), end="", flush=True)
+    pending.clear()
+    last_write = time.monotonic()
+
+
+def write(text):
+    pending.append(text)
+    if time.monotonic() - last_write >= MAX_DELAY:
+        flush()
+
+
 def handle_tool_call(tool_call: ChatCompletionMessageToolCall):
     tool_name = tool_call.function.name
     tool_args = json.loads(tool_call.function.arguments)
@@ -138,7 +159,8 @@ for chunk in stream:
         else:
             # No tool calls, just stream the message
             content = delta.content or ""
-            print(content, end="", flush=True)
+            write(content)
+flush()
 
 
 if len(tool_calls) > 0:
@@ -159,4 +181,5 @@ if len(tool_calls) > 0:
     stream = call_llm(messages=messages, stream=True)
     for chunk in stream:
         content = chunk.choices[0].delta.content or ""
-        print(content, end="", flush=True)
+        write(content)
+    flush()